@@ -0,0 +1,185 @@
+import json
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from pymongo.errors import OperationFailure, PyMongoError
+from prediction_cache import normalize_symbol
+from db_indexes import as_utc
+
+def analysis_payload(symbol, analysis_results, last_updated):
+    """The pushed event body, shaped like a /api/getAnalysis response"""
+    return json.dumps({
+        "symbol": normalize_symbol(symbol),
+        "analysis": analysis_results,
+        "lastUpdated": last_updated.isoformat(),
+    })
+
+class Subscription:
+    """One connected client: its username, symbols and queue of encoded payloads"""
+
+    def __init__(self, username, symbols):
+        self.username = username
+        self.symbols = {normalize_symbol(symbol) for symbol in symbols}
+        self.queue = queue.Queue()
+        self.seen = {}  # symbol -> lastUpdated of the last payload queued
+
+    def offer(self, symbol, last_updated, payload):
+        # The same update can arrive from a local publish and from the change stream
+        if symbol in self.seen and self.seen[symbol] >= last_updated:
+            return
+        self.seen[symbol] = last_updated
+        self.queue.put(payload)
+
+    def next(self, timeout):
+        """The next encoded payload, or None if nothing arrived within timeout seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class AnalysisBroker:
+    """Pushes saved analyses to the clients subscribed to their symbols.
+
+    Updates come from three places, whichever are available:
+
+    - publish(), called by this process right after it writes an analysis
+    - a change stream on the analyses collection (needs a replica set), so
+      writes by other processes such as `python scheduler.py` arrive too
+    - without change streams, one query every poll_seconds for analyses
+      updated since the last one, made only while someone is subscribed
+
+    Subscribers are indexed by symbol. Each update is encoded once and
+    handed to that symbol's subscribers for the analysis' users.
+
+    Every open subscription occupies a server thread, so at most
+    max_subscribers are accepted per process; subscribe() returns None
+    beyond that and clients fall back to polling /api/getAnalysis.
+    """
+
+    def __init__(self, collection, poll_seconds: int = 5, max_subscribers: int = 32):
+        self.collection = collection
+        self.poll_seconds = poll_seconds
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._count = 0
+        self._by_symbol = {}  # symbol -> set of Subscriptions
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, username, symbols):
+        """A new Subscription, or None when max_subscribers are already connected"""
+        subscription = Subscription(username, symbols)
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            self._count += 1
+            for symbol in subscription.symbols:
+                self._by_symbol.setdefault(symbol, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._count -= 1
+            for symbol in subscription.symbols:
+                subscribers = self._by_symbol.get(symbol)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_symbol[symbol]
+
+    def snapshot(self, subscription):
+        """Queue the subscriber's current analyses, so a (re)connecting client starts up to date"""
+        try:
+            docs = list(self.collection.find(
+                {"username": subscription.username, "lastUpdated": {"$type": "date"}},
+                {"_id": 0, "symbol": 1, "analysisResults": 1, "lastUpdated": 1}))
+        except PyMongoError as e:
+            print(f"Error reading analyses for {subscription.username}: {e}")
+            return
+        for doc in docs:
+            symbol = normalize_symbol(doc["symbol"])
+            if symbol in subscription.symbols:
+                last_updated = as_utc(doc["lastUpdated"])
+                subscription.offer(symbol, last_updated,
+                                   analysis_payload(symbol, doc.get("analysisResults"), last_updated))
+
+    def publish(self, symbol, usernames, analysis_results, last_updated):
+        """Push one symbol's new analysis to the subscribers among usernames"""
+        symbol = normalize_symbol(symbol)
+        usernames = set(usernames)
+        with self._lock:
+            subscribers = [s for s in self._by_symbol.get(symbol, ()) if s.username in usernames]
+        if not subscribers:
+            return
+        payload = analysis_payload(symbol, analysis_results, last_updated)
+        for subscription in subscribers:
+            subscription.offer(symbol, last_updated, payload)
+
+    def _subscribed_symbols(self):
+        with self._lock:
+            return list(self._by_symbol)
+
+    def _publish_doc(self, doc):
+        if doc and isinstance(doc.get("lastUpdated"), datetime):
+            self.publish(doc["symbol"], [doc["username"]], doc.get("analysisResults"), as_utc(doc["lastUpdated"]))
+
+    def _watch(self):
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+        with self.collection.watch(pipeline, full_document='updateLookup') as stream:
+            while not self._stop.is_set():
+                change = stream.try_next()
+                if change is None:
+                    self._stop.wait(0.5)
+                    continue
+                self._publish_doc(change.get("fullDocument"))
+
+    def _poll(self):
+        since = datetime.now(timezone.utc)
+        while not self._stop.wait(self.poll_seconds):
+            symbols = self._subscribed_symbols()
+            if not symbols:
+                since = datetime.now(timezone.utc)
+                continue
+            try:
+                # Saved symbols keep the client's casing, so match the common forms
+                docs = list(self.collection.find(
+                    {"symbol": {"$in": symbols + [s.lower() for s in symbols]}, "lastUpdated": {"$gt": since}},
+                    {"_id": 0, "username": 1, "symbol": 1, "analysisResults": 1, "lastUpdated": 1}))
+            except PyMongoError as e:
+                print(f"Error polling analyses: {e}")
+                continue
+            for doc in docs:
+                since = max(since, as_utc(doc["lastUpdated"]))
+                self._publish_doc(doc)
+
+    def run_forever(self):
+        try:
+            self._watch()
+        except OperationFailure as e:
+            print(f"Analysis change stream unavailable ({e}); polling every {self.poll_seconds}s instead")
+            self._poll()
+        except Exception as e:
+            if not self._stop.is_set():
+                print(f"Analysis change stream failed ({e}); polling every {self.poll_seconds}s instead")
+                self._poll()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run_forever, name='analysis-updates', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+def from_env(collection) -> AnalysisBroker:
+    """Build the broker from ANALYSIS_POLL_SECONDS / ANALYSIS_MAX_SUBSCRIBERS.
+
+    By default half of a worker's GUNICORN_THREADS may hold subscriptions,
+    leaving the rest for ordinary requests.
+    """
+    return AnalysisBroker(
+        collection,
+        poll_seconds=int(os.getenv("ANALYSIS_POLL_SECONDS", "5")),
+        max_subscribers=int(os.getenv("ANALYSIS_MAX_SUBSCRIBERS") or int(os.getenv("GUNICORN_THREADS", "64")) // 2),
+    )
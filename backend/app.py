@@ -1,23 +1,163 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 from dotenv import load_dotenv
 import json
 from bson import json_util
-from gemini_calls import scrape_formatting, model_setup
-from datetime import datetime
+from gemini_calls import run_prediction, run_batch_prediction, prediction_events, replay_events, get_model, generate_key_words
+from prediction_cache import normalize_symbol, from_env as prediction_cache_from_env
+from scheduler import scheduler_from_env, acquire_scheduler_lock
+from article_store import from_env as article_store_from_env
+from keyword_cache import from_env as keyword_cache_from_env
+from jobs import job_view, from_env as job_queue_from_env
+from market_data import MarketDataError, from_env as market_data_from_env
+from analysis_updates import from_env as analysis_broker_from_env
+import scrape_articles
+import gemini_calls
+from prediction_memo import PredictionMemo
+from db_indexes import ensure_indexes, as_utc
+from rate_limit import RateLimitExceeded
+import metrics
+import math
+import re
+from datetime import date, datetime, timezone
+
+try:
+    from flask_compress import Compress
+except ImportError:  # flask-compress is optional; responses are then sent uncompressed
+    Compress = None
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app)  # This will enable CORS for all routes
 
-# MongoDB Connection
-mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
-client = MongoClient(mongo_uri)
-db = client.stockerdb  # Database name
+# gzip/brotli JSON responses when the client accepts them (server-sent events are left alone)
+if Compress is not None and os.getenv("COMPRESS_RESPONSES", "true").lower() == "true":
+    app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/plain']
+    Compress(app)
+
+# Per-process resources, set up by create_app() once the process has forked
+client = None
+db = None
+prediction_cache = None
+keyword_cache = None
+job_queue = None
+market_data = None
+analysis_broker = None
+scheduler = None
+
+def create_app():
+    """Connect this process to MongoDB, build its caches and return the app.
+
+    Call it once per process after any fork (gunicorn imports wsgi.py in
+    each worker): MongoClient, the Gemini pool and the scraper's thread
+    pools must not be shared across a fork.
+    """
+    global client, db, prediction_cache, keyword_cache, job_queue, market_data, analysis_broker, scheduler
+    if client is not None:
+        return app
+
+    # With several server processes /metrics sums what each writes to PROMETHEUS_MULTIPROC_DIR
+    metrics.start_multiprocess(os.getenv("PROMETHEUS_MULTIPROC_DIR"), float(os.getenv("METRICS_FLUSH_SECONDS", "5")))
+
+    # MongoDB Connection
+    mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+    client = MongoClient(mongo_uri, event_listeners=[metrics.MongoListener()])
+    db = client.stockerdb  # Database name
+
+    # Unique indexes for every lookup below (and the optional analyses TTL from ANALYSIS_TTL_SECONDS)
+    ensure_indexes(db)
+
+    # Shared per-symbol prediction cache (memory LRU backed by the predictions collection)
+    prediction_cache = prediction_cache_from_env(db.predictions)
+
+    # Headline keywords per ticker, regenerated only every KEYWORD_REFRESH_SECONDS
+    keyword_cache = keyword_cache_from_env(generate_key_words, db.keywords)
+
+    # Predictions submitted through /api/predict/jobs, run on JOB_WORKERS threads (or by `python jobs.py`)
+    job_queue = job_queue_from_env(db.jobs, cached_prediction).start()
+
+    # Polygon data shared by every user: reference data, stored bars and previous closes
+    market_data = market_data_from_env(db)
+
+    # Per-source answers reused while a symbol's matched articles stay the same
+    gemini_calls.set_prediction_memo(PredictionMemo(db.predictions))
+
+    # Articles are fetched and parsed once, then shared across symbols and requests
+    scrape_articles.set_article_store(article_store_from_env(db.articles))
+
+    # Saved analyses pushed to /api/analyses/subscribe clients (change stream, else ANALYSIS_POLL_SECONDS)
+    analysis_broker = analysis_broker_from_env(db.analyses).start()
+
+    # Optionally precompute analyses in-process; otherwise run `python scheduler.py` as a worker.
+    # With several server processes only the one holding the scheduler lock runs it
+    if os.getenv("ENABLE_SCHEDULER", "false").lower() == "true" and acquire_scheduler_lock():
+        scheduler = scheduler_from_env(db, prediction_cache, keyword_cache, on_saved=analysis_broker.publish).start()
+
+    return app
+
+def shutdown():
+    """Stop background work and release connections before the process exits"""
+    global client
+    if scheduler is not None:
+        scheduler.stop()
+    if job_queue is not None:
+        job_queue.stop()
+    if market_data is not None:
+        market_data.shutdown()
+    if analysis_broker is not None:
+        analysis_broker.stop()
+    get_model().shutdown()
+    scrape_articles.shutdown()
+    metrics.stop()
+    if client is not None:
+        client.close()
+        client = None
+
+# Most symbols one /api/predict/batch request may ask for
+BATCH_MAX_SYMBOLS = int(os.getenv("BATCH_MAX_SYMBOLS", "50"))
+
+# Per-request stage timings, returned in a Server-Timing header
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() == "true"
+
+@app.before_request
+def start_request_timing():
+    if SERVER_TIMING:
+        metrics.start_request()
+
+@app.after_request
+def add_server_timing(response):
+    if SERVER_TIMING:
+        timing = metrics.server_timing()
+        if timing:
+            response.headers['Server-Timing'] = timing
+    return response
+
+metrics.register_gauge('stocker_llm_in_flight', lambda: get_model().metrics()['in_flight'])
+metrics.register_gauge('stocker_llm_queue_depth', lambda: get_model().metrics()['queue_depth'])
+
+# Gemini quota exhausted or its queue full: fail fast and tell the client when to retry
+@app.errorhandler(RateLimitExceeded)
+def rate_limited(e):
+    retry_after = math.ceil(e.retry_after)
+    response = jsonify({"success": False, "message": str(e), "retryAfter": retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+# Polygon unreachable and nothing stored to fall back on
+@app.errorhandler(MarketDataError)
+def market_data_unavailable(e):
+    return jsonify({"success": False, "message": str(e)}), 502
+
+# Prometheus scrape endpoint
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/test', methods=['GET'])
 def test_route():
@@ -39,8 +179,8 @@ def signup():
     data = request.json
     print(f"Signup request: {json.dumps(data, indent=2)}")
     
-    # Check if username already exists
-    if db.users.find_one({"username": data['username']}):
+    # Check if username already exists (in case the unique index could not be created)
+    if db.users.find_one({"username": data['username']}, {"_id": 1}):
         return jsonify({"success": False, "message": "Username already exists"}), 400
     
     # Create new user
@@ -51,7 +191,11 @@ def signup():
         "frequency": "every_5_minutes"  # Default frequency changed from daily
     }
     
-    db.users.insert_one(user)
+    # The unique index on username also rejects a name taken by a concurrent signup
+    try:
+        db.users.insert_one(user)
+    except DuplicateKeyError:
+        return jsonify({"success": False, "message": "Username already exists"}), 400
     print(f"Created user: {data['username']}")
     
     return jsonify({"success": True, "message": "User created successfully"})
@@ -65,7 +209,8 @@ def signin():
     print(f"Signin request: {json.dumps(data, indent=2)}")
     
     # Find user
-    user = db.users.find_one({"username": data['username']})
+    user = db.users.find_one({"username": data['username']},
+                             {"_id": 0, "username": 1, "password": 1, "stocks": 1, "frequency": 1})
     
     if not user or not check_password_hash(user['password'], data['password']):
         print(f"Login failed for user: {data['username']}")
@@ -158,7 +303,7 @@ def get_user_data():
         return jsonify({"success": False, "message": "Username is required"}), 400
     
     # Find user
-    user = db.users.find_one({"username": username})
+    user = db.users.find_one({"username": username}, {"_id": 0, "password": 0})
     
     if not user:
         return jsonify({"success": False, "message": "User not found"}), 404
@@ -170,51 +315,164 @@ def get_user_data():
         "frequency": user.get('frequency', 'every_5_minutes')
     }
     
-    return jsonify({"success": True, "user": user_data})
+    # The document is small, so its ETag is a hash of the body; unchanged data gets a 304
+    response = jsonify({"success": True, "user": user_data})
+    response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+def cached_prediction(stock_symbol):
+    return prediction_cache.get_or_compute(
+        stock_symbol, lambda: run_prediction(stock_symbol, get_model(), keyword_cache.get))
 
 @app.route('/api/predict', methods=['POST', 'OPTIONS'])
 def individual_prediction():
     if request.method == 'OPTIONS':
         return handle_options()
         
-    model = model_setup()
-    
     data = request.json
-    stock_symbol = data['stock']
-    #dictionary mapping source to prompt. groups of 5
-    source_to_prompt, aggregated = scrape_formatting(stock_symbol, model)
-    results = {}
-    final_input = ""
-    count = 1
-
-    for source, prompt in source_to_prompt.items():
-      individual_prompt = f""" You are an expert in the stock market and are responsible for informing clients about the potential impact of recent events on a particular stock. 
-                              Here are step by step examples of how to generate the prediction based on each source of information:
-                              Example 1:
-                              Article 1: Information: ​In the 2024 U.S. presidential election, former President Donald Trump defeated Vice President Kamala Harris, securing 312 electoral votes to Harris's 226. Trump also won the popular vote with 49.8% against Harris's 48.3%. This victory marked Trump's return to the White House for a non-consecutive second term. ​
-                              Article 2: BYD has opened a $490 million EV factory in Thailand and is building a $1 billion plant in Indonesia, set to finish by end of 2025. Each factory will produce 150,000 vehicles annually, supporting BYD's plan to double overseas sales to over 800,000 units by 2025.
-                              Prediction: Trump's return could boost U.S. manufacturing and deregulation, potentially favoring Tesla. However, BYD's aggressive global expansion may intensify EV competition. Combined, Tesla's stock may face short-term optimism from policy shifts but long-term pressure from rising international rivals like BYD, possibly resulting in increased volatility and mixed investor sentiment.
-
-                              Example 2:
-                              Article 1: In the second quarter of fiscal 2025, NVIDIA reported record revenue of $30.0 billion, a 122% year-over-year increase, surpassing analyst expectations. Earnings per share reached $0.67, up 168% from the previous year. This growth was driven by strong demand for AI-related products, particularly in data centers. ​
-                              Article 2: President Trump, since his January 2025 inauguration, has implemented a range of new tariffs, although specific details fall after my October 2024 knowledge cutoff. Prior to leaving office in 2021, Trump was known for aggressive tariff policies, particularly targeting China, steel, aluminum, and various European goods. ​
-                              Prediction: NVIDIA's record-breaking Q2 performance, driven by AI demand, suggests strong upward momentum. However, Trump's new tariffs could disrupt global supply chains and raise costs, especially if China is targeted. Despite potential trade tensions, NVIDIA's dominance in AI may sustain investor confidence, keeping its stock resilient with possible short-term fluctuations.                            
-
-                              Now it's your turn. Given the information, write a 50-word prediction as to how that might affect {stock_symbol} in the short term.
-                              {prompt}"""
-      response = model.invoke(individual_prompt).content
-      sentiment = model.invoke(f'Based on the following prediction, indicate whether the prediction is Positive, Negative, or Neutral. ONLY provide the word.\n{response}').content
-      results[source] = (response, sentiment)
-      final_input += f'Prediction {count}: {response}\nSentiment {count}: {sentiment} \n'
-      count += 1
-
-    final_prediction = model.invoke(f'From all the information provided, provide a 50-word final prediction about whether you think the {stock_symbol} stock will rise, fall, or remain the same and why:\n{final_input}').content
-    final_sentiment = model.invoke(f'Based on the following prediction, indicate whether the prediction is Positive, Negative, or Neutral. ONLY provide the word.\n{final_prediction}').content
-
-    aggregated['individual_predictions'] = results
-    aggregated['final_prediction'] = (final_prediction, final_sentiment)
+    # One spelling per symbol in the cache key, the prompts and the memo fingerprints
+    stock_symbol = normalize_symbol(data['stock'])
+    aggregated = cached_prediction(stock_symbol)
     return jsonify({"success": True, "results": aggregated})
 
+@app.route('/api/predict/batch', methods=['POST', 'OPTIONS'])
+def batch_prediction():
+    """Predictions for a whole portfolio, sharing one scrape and packed Gemini calls"""
+    if request.method == 'OPTIONS':
+        return handle_options()
+
+    stocks = (request.json or {}).get('stocks')
+    if not isinstance(stocks, list) or not stocks:
+        return jsonify({"success": False, "message": "Stocks must be a non-empty list"}), 400
+
+    symbols = list(dict.fromkeys(normalize_symbol(stock) for stock in stocks if isinstance(stock, str) and stock.strip()))
+    if len(symbols) > BATCH_MAX_SYMBOLS:
+        return jsonify({"success": False, "message": f"At most {BATCH_MAX_SYMBOLS} stocks per batch"}), 400
+
+    # Symbols another request is already predicting are waited on rather than predicted again
+    results, errors = prediction_cache.get_or_compute_many(
+        symbols, lambda missing: run_batch_prediction(missing, get_model(), keyword_cache.get))
+
+    return jsonify({"success": True, "results": results, "errors": errors})
+
+@app.route('/api/predict/jobs', methods=['POST', 'OPTIONS'])
+def submit_prediction_job():
+    """Start a prediction without waiting for it; poll the returned job id"""
+    if request.method == 'OPTIONS':
+        return handle_options()
+
+    stock_symbol = (request.json or {}).get('stock')
+    if not stock_symbol:
+        return jsonify({"success": False, "message": "Stock is required"}), 400
+
+    job = job_view(job_queue.submit(stock_symbol))
+    response = jsonify({"success": True, "job": job})
+    response.status_code = 202
+    response.headers['Location'] = f"/api/predict/jobs/{job['id']}"
+    return response
+
+@app.route('/api/predict/jobs/<job_id>', methods=['GET', 'OPTIONS'])
+def get_prediction_job(job_id):
+    if request.method == 'OPTIONS':
+        return handle_options()
+
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    return jsonify({"success": True, "job": job_view(job)})
+
+# Reconnect delay sent to EventSource clients once a prediction stream is complete
+SSE_DONE_RETRY_MS = 24 * 60 * 60 * 1000
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/predict/stream', methods=['GET', 'POST', 'OPTIONS'])
+def stream_prediction():
+    """Same pipeline as /api/predict, sent as Server-Sent Events while it runs.
+
+    The stream ends after the "final" (or "error") event. EventSource clients
+    should close() on it; otherwise they only reconnect after SSE_DONE_RETRY_MS.
+    """
+    if request.method == 'OPTIONS':
+        return handle_options()
+
+    # GET lets browsers connect with EventSource
+    stock_symbol = request.args.get('stock') if request.method == 'GET' else request.json.get('stock')
+    if not stock_symbol or not stock_symbol.strip():
+        return jsonify({"success": False, "message": "Stock is required"}), 400
+    stock_symbol = normalize_symbol(stock_symbol)
+
+    def generate():
+        try:
+            events = prediction_cache.stream(
+                stock_symbol,
+                lambda: prediction_events(stock_symbol, get_model(), keyword_cache.get),
+                replay_events)
+            for event, data in events:
+                yield sse_event(event, data)
+        except RateLimitExceeded as e:
+            yield sse_event('error', {"success": False, "message": str(e), "retryAfter": math.ceil(e.retry_after)})
+        except Exception as e:
+            print(f"Error streaming prediction for {stock_symbol}: {e}")
+            yield sse_event('error', {"success": False, "message": str(e)})
+        # The prediction is complete: an EventSource reconnecting right away would only start it again
+        yield f"retry: {SSE_DONE_RETRY_MS}\n\n"
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+def browser_cacheable(response, seconds):
+    response.headers['Cache-Control'] = f"private, max-age={seconds}"
+    return response
+
+@app.route('/api/market/ticker/<symbol>', methods=['GET', 'OPTIONS'])
+def market_ticker(symbol):
+    """Reference data (name, market) for a ticker; valid is false for unknown tickers"""
+    if request.method == 'OPTIONS':
+        return handle_options()
+    return browser_cacheable(jsonify({"success": True, "ticker": market_data.ticker(symbol)}), 3600)
+
+@app.route('/api/market/batch', methods=['POST', 'OPTIONS'])
+def market_batch():
+    """Reference data for a whole portfolio in one response"""
+    if request.method == 'OPTIONS':
+        return handle_options()
+
+    symbols = (request.json or {}).get('symbols')
+    if not isinstance(symbols, list) or not symbols:
+        return jsonify({"success": False, "message": "Symbols must be a non-empty list"}), 400
+    symbols = [symbol for symbol in symbols if isinstance(symbol, str) and symbol.strip()]
+    if len(symbols) > BATCH_MAX_SYMBOLS:
+        return jsonify({"success": False, "message": f"At most {BATCH_MAX_SYMBOLS} symbols per batch"}), 400
+
+    results, errors = market_data.ticker_batch(symbols)
+    return jsonify({"success": True, "results": results, "errors": errors})
+
+@app.route('/api/market/bars/<symbol>', methods=['GET', 'OPTIONS'])
+def market_bars(symbol):
+    """Aggregate bars between the from and to dates (YYYY-MM-DD), in Polygon's results format"""
+    if request.method == 'OPTIONS':
+        return handle_options()
+
+    try:
+        start = date.fromisoformat(request.args.get('from', ''))
+        end = date.fromisoformat(request.args.get('to', ''))
+        bars = market_data.bars_between(symbol, start, end, request.args.get('timespan', 'day'))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return browser_cacheable(jsonify({"success": True, "results": bars}), 60)
+
+@app.route('/api/market/prev/<symbol>', methods=['GET', 'OPTIONS'])
+def market_previous_close(symbol):
+    """The previous trading day's aggregate bar"""
+    if request.method == 'OPTIONS':
+        return handle_options()
+    return browser_cacheable(jsonify({"success": True, "results": market_data.previous_close(symbol)}), 60)
+
 # Debug endpoint to view all users (do not use in production)
 @app.route('/api/debug/users', methods=['GET'])
 def debug_users():
@@ -222,6 +480,11 @@ def debug_users():
     # Convert ObjectId to string for JSON serialization
     return json.loads(json_util.dumps(users))
 
+# Debug endpoint to view the shared Gemini client's load and latency
+@app.route('/api/debug/model', methods=['GET'])
+def debug_model():
+    return jsonify(get_model().metrics())
+
 # Debug endpoint to view specific user data
 @app.route('/api/debug/user/<username>', methods=['GET'])
 def debug_user(username):
@@ -245,25 +508,23 @@ def save_analysis():
     
     try:
         # Check if user exists
-        user = db.users.find_one({"username": username})
+        user = db.users.find_one({"username": username}, {"_id": 1})
         if not user:
             return jsonify({"success": False, "message": "User not found"})
         
-        # Create analyses collection if it doesn't exist
-        if "analyses" not in db.list_collection_names():
-            db.create_collection("analyses")
-        
         # Upsert analysis document
+        last_updated = datetime.now(timezone.utc)
         db.analyses.update_one(
             {"username": username, "symbol": symbol},
             {"$set": {
                 "username": username,
                 "symbol": symbol,
                 "analysisResults": analysis_results,
-                "lastUpdated": datetime.now()
+                "lastUpdated": last_updated
             }},
             upsert=True
         )
+        analysis_broker.publish(symbol, [username], analysis_results, last_updated)
         
         return jsonify({"success": True, "message": "Analysis saved successfully"})
     
@@ -271,6 +532,25 @@ def save_analysis():
         print(f"Error saving analysis: {e}")
         return jsonify({"success": False, "message": str(e)})
 
+def analysis_validators(last_updated, fields):
+    """ETag and Last-Modified of an analysis as of last_updated, for the requested fields"""
+    etag = f"{last_updated.timestamp():.6f}-{','.join(fields) if fields else 'all'}"
+    return etag, last_updated.astimezone().replace(microsecond=0)
+
+def with_validators(response, etag, last_modified):
+    # Weak, since compression changes the bytes but not the content
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    # Browsers revalidate on every request instead of guessing a freshness lifetime
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def not_modified(etag, last_modified):
+    """True if the request's If-None-Match / If-Modified-Since show the client has this version"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return request.if_modified_since is not None and last_modified <= request.if_modified_since
+
 @app.route('/api/getAnalysis', methods=['GET', 'OPTIONS'])
 def get_analysis():
     if request.method == 'OPTIONS':
@@ -278,26 +558,47 @@ def get_analysis():
     
     username = request.args.get('username')
     symbol = request.args.get('symbol')
+    # Optional comma separated analysisResults fields, e.g. fields=sentiment,summary
+    fields = [field for field in request.args.get('fields', '').split(',') if field]
     
     if not username or not symbol:
         return jsonify({"success": False, "message": "Missing required fields"})
+    if not all(re.fullmatch(r'\w+', field) for field in fields):
+        return jsonify({"success": False, "message": "Invalid fields"}), 400
     
     try:
+        query = {"username": username, "symbol": symbol}
+        # A revalidation only needs lastUpdated; skip loading the articles if the client is current
+        if request.if_none_match or request.if_modified_since:
+            stamp = db.analyses.find_one(query, {"_id": 0, "lastUpdated": 1})
+            if stamp and isinstance(stamp.get('lastUpdated'), datetime):
+                etag, last_modified = analysis_validators(as_utc(stamp['lastUpdated']), fields)
+                if not_modified(etag, last_modified):
+                    return with_validators(app.response_class(status=304), etag, last_modified)
+
         # Find the analysis document
-        analysis = db.analyses.find_one({"username": username, "symbol": symbol})
+        projection = {"_id": 0, "lastUpdated": 1}
+        if fields:
+            projection.update({f"analysisResults.{field}": 1 for field in fields})
+        else:
+            projection["analysisResults"] = 1
+        analysis = db.analyses.find_one(query, projection)
         
         if analysis:
-            # Convert ObjectId to string for JSON serialization
-            analysis['_id'] = str(analysis['_id'])
+            last_updated = analysis.get('lastUpdated')
             # Convert datetime to ISO format string
-            if isinstance(analysis.get('lastUpdated'), datetime):
-                analysis['lastUpdated'] = analysis['lastUpdated'].isoformat()
+            if isinstance(last_updated, datetime):
+                last_updated = as_utc(last_updated)
+                analysis['lastUpdated'] = last_updated.isoformat()
             
-            return jsonify({
+            response = jsonify({
                 "success": True, 
                 "analysis": analysis.get('analysisResults'),
                 "lastUpdated": analysis.get('lastUpdated')
             })
+            if isinstance(last_updated, datetime):
+                response = with_validators(response, *analysis_validators(last_updated, fields))
+            return response
         else:
             return jsonify({"success": False, "message": "Analysis not found"})
     
@@ -305,6 +606,51 @@ def get_analysis():
         print(f"Error retrieving analysis: {e}")
         return jsonify({"success": False, "message": str(e)})
 
+# Seconds between keep-alive comments on an idle /api/analyses/subscribe stream
+SUBSCRIBE_HEARTBEAT_SECONDS = 25
+
+@app.route('/api/analyses/subscribe', methods=['GET', 'OPTIONS'])
+def subscribe_analyses():
+    """Server-Sent Events: an "analysis" event whenever one of the user's symbols is saved.
+
+    The current analyses are sent first, so reconnecting clients catch up
+    on anything they missed while disconnected.
+    """
+    if request.method == 'OPTIONS':
+        return handle_options()
+
+    username = request.args.get('username')
+    symbols = [symbol for symbol in request.args.get('symbols', '').split(',') if symbol.strip()]
+    if not username or not symbols:
+        return jsonify({"success": False, "message": "Username and symbols are required"}), 400
+    if len(symbols) > BATCH_MAX_SYMBOLS:
+        return jsonify({"success": False, "message": f"At most {BATCH_MAX_SYMBOLS} symbols per subscription"}), 400
+    if not db.users.find_one({"username": username}, {"_id": 1}):
+        return jsonify({"success": False, "message": "User not found"}), 404
+
+    subscription = analysis_broker.subscribe(username, symbols)
+    if subscription is None:
+        # Every subscription holds a server thread; past the cap clients poll /api/getAnalysis instead
+        response = jsonify({"success": False, "message": "Too many open subscriptions, poll /api/getAnalysis instead"})
+        response.status_code = 503
+        response.headers['Retry-After'] = '600'
+        return response
+    analysis_broker.snapshot(subscription)
+
+    def generate():
+        while True:
+            payload = subscription.next(SUBSCRIBE_HEARTBEAT_SECONDS)
+            yield f"event: analysis\ndata: {payload}\n\n" if payload is not None else ": keep-alive\n\n"
+
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    # Runs when the server closes the response, even if the body was never
+    # iterated (HEAD requests), so the slot is always given back
+    response.call_on_close(lambda: analysis_broker.unsubscribe(subscription))
+    return response
+
 @app.route('/api/update_username', methods=['POST', 'OPTIONS'])
 def update_username():
     if request.method == 'OPTIONS':
@@ -320,7 +666,7 @@ def update_username():
     
     try:
         # Check if user exists
-        user = db.users.find_one({"username": current_username})
+        user = db.users.find_one({"username": current_username}, {"password": 1})
         if not user:
             return jsonify({"success": False, "message": "User not found"}), 404
         
@@ -328,24 +674,26 @@ def update_username():
         if not check_password_hash(user['password'], password):
             return jsonify({"success": False, "message": "Incorrect password"}), 401
         
-        # Check if new username is already taken
-        if db.users.find_one({"username": new_username}) and new_username != current_username:
+        # Check if new username is already taken (in case the unique index could not be created)
+        if new_username != current_username and db.users.find_one({"username": new_username}, {"_id": 1}):
             return jsonify({"success": False, "message": "Username already exists"}), 400
         
         # Update username in all collections
         
-        # 1. Update in users collection
-        db.users.update_one(
-            {"username": current_username},
-            {"$set": {"username": new_username}}
-        )
-        
-        # 2. Update in analyses collection
-        if "analyses" in db.list_collection_names():
-            db.analyses.update_many(
+        # 1. Update in users collection (the unique index also rejects a name taken concurrently)
+        try:
+            db.users.update_one(
                 {"username": current_username},
                 {"$set": {"username": new_username}}
             )
+        except DuplicateKeyError:
+            return jsonify({"success": False, "message": "Username already exists"}), 400
+        
+        # 2. Update in analyses collection
+        db.analyses.update_many(
+            {"username": current_username},
+            {"$set": {"username": new_username}}
+        )
         
         return jsonify({"success": True, "message": "Username updated successfully"})
     
@@ -368,7 +716,7 @@ def update_password():
     
     try:
         # Check if user exists
-        user = db.users.find_one({"username": username})
+        user = db.users.find_one({"username": username}, {"password": 1})
         if not user:
             return jsonify({"success": False, "message": "User not found"}), 404
         
@@ -392,4 +740,6 @@ def update_password():
         return jsonify({"success": False, "message": str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, port=8000) 
\ No newline at end of file
+    # Development server; in production run `gunicorn -c gunicorn.conf.py wsgi:app`
+    create_app().run(debug=os.getenv("FLASK_DEBUG", "false").lower() == "true",
+                     port=int(os.getenv("PORT", "8000"))) 
\ No newline at end of file
@@ -0,0 +1,111 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Query parameters that never change an article's content
+TRACKING_PARAMS = {'fbclid', 'gclid', 'cmpid', 'ref'}
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+def normalize_url(url: str) -> str:
+    """Canonical form of an article URL so the same story is stored once"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not (key.lower().startswith('utm_') or key.lower() in TRACKING_PARAMS)
+    ))
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/')
+    return urlunsplit((scheme, host, path, query, ''))
+
+class ArticleStore:
+    """Extracted article paragraphs keyed by normalized URL.
+
+    Entries younger than ttl are served without touching the network; older
+    ones keep their ETag / Last-Modified so the scraper can revalidate them
+    with a conditional GET instead of downloading the page again.
+    """
+
+    def __init__(self, collection=None, ttl: int = 6 * 60 * 60, max_memory: int = 2048):
+        self.collection = collection
+        self.ttl = ttl
+        self.max_memory = max_memory
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url: str):
+        """Return the stored article document for the url, or None"""
+        key = normalize_url(url)
+        with self._lock:
+            doc = self._memory.get(key)
+            if doc is not None:
+                self._memory.move_to_end(key)
+                return doc
+        if self.collection is None:
+            return None
+        try:
+            doc = self.collection.find_one({"url": key}, {"_id": 0})
+        except Exception as e:
+            print(f"Error reading stored article {key}: {e}")
+            return None
+        if doc is not None:
+            self._remember(key, doc)
+        return doc
+
+    def is_fresh(self, doc) -> bool:
+        return doc["fetchedAt"] > datetime.now() - timedelta(seconds=self.ttl)
+
+    def put(self, url: str, first_paragraph: str, etag: str = None, last_modified: str = None):
+        key = normalize_url(url)
+        doc = {
+            "url": key,
+            "first_paragraph": first_paragraph,
+            "etag": etag,
+            "lastModified": last_modified,
+            "fetchedAt": datetime.now(),
+        }
+        self._remember(key, doc)
+        self._save(key, doc)
+
+    def touch(self, url: str):
+        """Mark a stored article as revalidated (the server answered 304)"""
+        doc = self.get(url)
+        if doc is None:
+            return
+        doc = dict(doc, fetchedAt=datetime.now())
+        key = normalize_url(url)
+        self._remember(key, doc)
+        self._save(key, doc)
+
+    def conditional_headers(self, doc) -> dict:
+        headers = {}
+        if doc.get("etag"):
+            headers['If-None-Match'] = doc["etag"]
+        if doc.get("lastModified"):
+            headers['If-Modified-Since'] = doc["lastModified"]
+        return headers
+
+    def _remember(self, key, doc):
+        with self._lock:
+            self._memory[key] = doc
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory:
+                self._memory.popitem(last=False)
+
+    def _save(self, key, doc):
+        if self.collection is None:
+            return
+        try:
+            self.collection.update_one({"url": key}, {"$set": doc}, upsert=True)
+        except Exception as e:
+            print(f"Error saving stored article {key}: {e}")
+
+def from_env(collection=None) -> ArticleStore:
+    """Build the store from ARTICLE_TTL"""
+    return ArticleStore(collection=collection, ttl=int(os.getenv("ARTICLE_TTL", str(6 * 60 * 60))))
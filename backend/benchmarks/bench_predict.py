@@ -0,0 +1,109 @@
+"""Offline benchmark of the predict pipeline.
+
+Serves the recorded front pages and articles in fixtures/ from a local HTTP
+server and swaps Gemini for FakeChatModel, so runs need no network and are
+repeatable. Reports p50/p95/p99 per stage and overall throughput:
+
+    python benchmarks/bench_predict.py --symbols 10 --rounds 5 --llm-latency 0.3
+"""
+import argparse
+import dataclasses
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scrape_articles
+import site_adapters
+from gemini_calls import prediction_events, run_batch_prediction
+from model_pool import ModelPool
+from fake_model import FakeChatModel
+from fixture_server import FixtureServer
+
+STAGES = ('keywords', 'scrape', 'predict', 'aggregate', 'total')
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def timed_run(symbol, model):
+    """Run the pipeline for one symbol and return {stage: [seconds, ...]}"""
+    timings = {stage: [] for stage in STAGES}
+    start = last = time.perf_counter()
+    scraped_at = None
+    for event, _ in prediction_events(symbol, model):
+        now = time.perf_counter()
+        if event == 'keywords':
+            timings['keywords'].append(now - last)
+        elif event == 'articles' and scraped_at is None:
+            # Every source's articles are emitted together once scraping ends
+            scraped_at = now
+            timings['scrape'].append(now - last)
+        elif event == 'prediction':
+            timings['predict'].append(now - scraped_at)
+        elif event == 'final':
+            timings['aggregate'].append(now - last)
+            timings['total'].append(now - start)
+        last = now
+    return timings
+
+def timed_batch(symbols, model):
+    """Run one batch prediction for every symbol; each symbol's total is the batch's"""
+    start = time.perf_counter()
+    results, errors = run_batch_prediction(symbols, model)
+    elapsed = time.perf_counter() - start
+    return [{'total': [elapsed]} for _ in results]
+
+def run_round(symbols, model, warm, batch=False):
+    if not warm:
+        # Cold round: fetch the front pages again as the first request of an interval would
+        scrape_articles._snapshot.clear()
+    if batch:
+        return timed_batch(symbols, model)
+    with ThreadPoolExecutor(max_workers=len(symbols)) as executor:
+        return list(executor.map(lambda symbol: timed_run(symbol, model), symbols))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--symbols', type=int, default=5, help='symbols analyzed concurrently per round')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--llm-latency', type=float, default=0.3, help='seconds per fake Gemini call')
+    parser.add_argument('--llm-jitter', type=float, default=0.1)
+    parser.add_argument('--fetch-latency', type=float, default=0.05, help='seconds added to every fixture response')
+    parser.add_argument('--llm-concurrency', type=int, default=8)
+    parser.add_argument('--warm', action='store_true', help='reuse the headline snapshot between rounds')
+    parser.add_argument('--batch', action='store_true', help='predict all symbols with one batch call per round')
+    args = parser.parse_args()
+
+    symbols = [f"SYM{i}" for i in range(args.symbols)]
+    fake = FakeChatModel(args.llm_latency, args.llm_jitter)
+    model = ModelPool(lambda: fake, max_concurrency=args.llm_concurrency)
+    scrape_articles.set_article_store(None)
+
+    with FixtureServer(args.fetch_latency) as server:
+        for name, url in server.site_urls().items():
+            site_adapters.register(dataclasses.replace(site_adapters.ADAPTERS[name], url=url))
+        timings = {stage: [] for stage in STAGES}
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            for run in run_round(symbols, model, args.warm, args.batch):
+                for stage, samples in run.items():
+                    timings[stage].extend(samples)
+        elapsed = time.perf_counter() - started
+
+    print(f"{args.rounds} round(s) x {args.symbols} concurrent symbol(s), "
+          f"fake LLM {args.llm_latency * 1000:.0f}ms, fetch {args.fetch_latency * 1000:.0f}ms")
+    print(f"{'stage':<10} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage in STAGES:
+        samples = timings[stage]
+        if samples:
+            print(f"{stage:<10} {len(samples):>5} " + " ".join(
+                f"{percentile(samples, q) * 1000:>9.1f}" for q in (0.5, 0.95, 0.99)))
+    completed = len(timings['total'])
+    print(f"throughput: {completed / elapsed:.2f} predictions/s ({completed} in {elapsed:.2f}s), "
+          f"{fake.calls} LLM calls")
+
+if __name__ == '__main__':
+    main()
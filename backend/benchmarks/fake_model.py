@@ -0,0 +1,49 @@
+import hashlib
+import json
+import random
+import re
+import time
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+def prompt_text(input):
+    """Flatten a string or list of chat messages into plain text"""
+    if isinstance(input, (list, tuple)):
+        return "\n".join(str(message[1] if isinstance(message, tuple) else getattr(message, 'content', message))
+                         for message in input)
+    return str(input)
+
+class FakeChatModel:
+    """Deterministic stand-in for ChatGoogleGenerativeAI.
+
+    Replies are chosen from the prompt, so the prediction chain parses them
+    like real output, and every call sleeps latency seconds plus a jitter
+    derived from the prompt text (the same prompt always takes as long).
+    """
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.1):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+
+    def invoke(self, input, config=None, **kwargs):
+        text = prompt_text(input)
+        self.calls += 1
+        seed = int(hashlib.sha256(text.encode()).hexdigest()[:8], 16)
+        time.sleep(self.latency + random.Random(seed).uniform(0, self.jitter))
+
+        if 'key words' in text:
+            return FakeResponse("'tariff', 'AI', 'earnings', 'chip', 'electric'")
+        sentiment = ('Positive', 'Negative', 'Neutral')[seed % 3]
+        if 'JSON object mapping every id' in text:
+            # Packed batch prompt: answer every "### <id>" item
+            return FakeResponse(json.dumps({
+                item_id: {"prediction": f"Recent coverage suggests a {sentiment.lower()} reaction in the short term.",
+                          "sentiment": sentiment}
+                for item_id in re.findall(r'^### (.+)$', text, re.MULTILINE)
+            }))
+        if 'final prediction' in text:
+            return FakeResponse(f"Prediction: Taken together the sources point to a {sentiment.lower()} short-term move.\nSentiment: {sentiment}")
+        return FakeResponse(f"Prediction: Recent coverage suggests a {sentiment.lower()} reaction in the short term.\nSentiment: {sentiment}")
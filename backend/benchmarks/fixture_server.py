@@ -0,0 +1,51 @@
+import functools
+import os
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+class _FixtureHandler(SimpleHTTPRequestHandler):
+    latency = 0.0
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            super().do_GET()
+        except (BrokenPipeError, ConnectionResetError):
+            # The scraper stops reading articles once it has the first paragraph
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+class FixtureServer:
+    """Serves the recorded front pages and articles from fixtures/ on localhost.
+
+    latency simulates the network round trip added to every response.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        handler = type('Handler', (_FixtureHandler,), {'latency': latency})
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(handler, directory=FIXTURES_DIR))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def site_urls(self):
+        """Front-page URL of every site adapter's fixture, by adapter name"""
+        return {site: f"{self.base_url}/{site}.html" for site in ('cnn', 'guardian', 'fox')}
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,82 @@
+import os
+from datetime import timezone
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+
+# Name of the optional TTL index expiring analyses by lastUpdated
+ANALYSIS_TTL_INDEX = 'lastUpdated_ttl'
+
+# collection -> [(keys, options)] for every lookup the app and workers make
+INDEXES = {
+    'users': [([('username', ASCENDING)], {'unique': True})],
+    'analyses': [([('username', ASCENDING), ('symbol', ASCENDING)], {'unique': True})],
+    'predictions': [([('symbol', ASCENDING)], {'unique': True})],
+    'keywords': [([('symbol', ASCENDING)], {'unique': True})],
+    'articles': [([('url', ASCENDING)], {'unique': True})],
+    'tickers': [([('symbol', ASCENDING)], {'unique': True})],
+    'bars': [([('symbol', ASCENDING), ('timespan', ASCENDING), ('t', ASCENDING)], {'unique': True})],
+    'bar_ranges': [([('symbol', ASCENDING), ('timespan', ASCENDING)], {'unique': True})],
+    'jobs': [
+        # Held only while a job is pending, so one pending job per symbol
+        ([('activeKey', ASCENDING)], {'unique': True, 'sparse': True}),
+        ([('status', ASCENDING), ('createdAt', ASCENDING)], {}),
+        # Finished jobs are kept for a day for clients to poll
+        ([('finishedAt', ASCENDING)], {'expireAfterSeconds': 24 * 60 * 60}),
+    ],
+}
+
+def as_utc(value):
+    """A datetime read back from MongoDB (naive, in UTC) as an aware UTC datetime.
+
+    TTL indexes expire documents by UTC, so TTL-indexed fields are written
+    with datetime.now(timezone.utc) and compared as aware datetimes.
+    """
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+def _create(collection, keys, **options):
+    try:
+        collection.create_index(keys, **options)
+        return True
+    except OperationFailure as e:
+        if e.code == 11000:
+            print(f"Cannot create unique index {keys} on {collection.name}: remove the duplicate documents first ({e})")
+        else:
+            print(f"Error creating index {keys} on {collection.name}: {e}")
+        return False
+
+def ensure_analysis_ttl(db, ttl_seconds):
+    """Expire analyses ttl_seconds after lastUpdated, or stop expiring them when ttl_seconds is falsy"""
+    existing = db.analyses.index_information().get(ANALYSIS_TTL_INDEX)
+    if not ttl_seconds:
+        if existing:
+            db.analyses.drop_index(ANALYSIS_TTL_INDEX)
+        return
+    if existing is None:
+        _create(db.analyses, [('lastUpdated', ASCENDING)], name=ANALYSIS_TTL_INDEX, expireAfterSeconds=ttl_seconds)
+    elif existing.get('expireAfterSeconds') != ttl_seconds:
+        # TTL indexes are changed in place rather than rebuilt
+        db.command({'collMod': 'analyses',
+                    'index': {'name': ANALYSIS_TTL_INDEX, 'expireAfterSeconds': ttl_seconds}})
+
+def ensure_indexes(db, analysis_ttl: int = None):
+    """Create every index the app relies on. Safe to run at each startup: existing indexes are kept"""
+    if analysis_ttl is None:
+        analysis_ttl = int(os.getenv("ANALYSIS_TTL_SECONDS", "0"))
+    try:
+        for name, indexes in INDEXES.items():
+            for keys, options in indexes:
+                _create(db[name], keys, **options)
+        ensure_analysis_ttl(db, analysis_ttl)
+    except PyMongoError as e:
+        print(f"Error ensuring MongoDB indexes: {e}")
+
+if __name__ == '__main__':
+    # Run the index migration by hand: python db_indexes.py
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    db = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017/")).stockerdb
+    ensure_indexes(db)
+    for name in INDEXES:
+        print(f"{name}: {', '.join(db[name].index_information())}")
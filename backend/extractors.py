@@ -0,0 +1,168 @@
+import codecs
+import os
+import time
+from bs4 import BeautifulSoup
+
+try:
+    from cssselect import GenericTranslator
+    from lxml import etree, html as lxml_html
+except ImportError:  # lxml and cssselect are optional; fall back to BeautifulSoup
+    etree = None
+
+# Elements BeautifulSoup's get_text leaves out
+_SKIPPED_TEXT_TAGS = {'script', 'style', 'template'}
+
+class SoupExtractor:
+    """Reference extractor using BeautifulSoup's html.parser"""
+
+    name = 'soup'
+
+    def headlines(self, adapter, text):
+        """Return [(title, url)] for the top headlines of a front page"""
+        soup = BeautifulSoup(text, 'html.parser')
+
+        headlines = []
+        for element in soup.select(adapter.headline_selector):
+            if adapter.link_selector:
+                link = source = element.select_one(adapter.link_selector)
+            else:
+                link = element if element.name == 'a' else element.find_parent('a')
+                source = element
+            if link is None:
+                continue
+            title = source.get(adapter.title_attribute, '') if adapter.title_attribute else source.get_text(strip=True)
+            headlines.append((title, link.get('href', '')))
+            if len(headlines) == adapter.max_headlines:
+                break
+        return headlines
+
+    def first_paragraph(self, adapter, chunks):
+        """Return the first body paragraph of an article given its text in chunks"""
+        article_soup = BeautifulSoup(''.join(chunks), 'html.parser')
+        content_div = article_soup.select_one(adapter.body_selector)
+        if content_div:
+            first_p = content_div.find('p')
+            return first_p.get_text(strip=True) if first_p else ""
+        return ""
+
+# Nearest <a> enclosing (or being) a headline
+NEAREST_LINK = etree.XPath("ancestor-or-self::a[1]") if etree else None
+
+def _text(element):
+    """Equivalent of BeautifulSoup's get_text(strip=True) for an lxml element"""
+    parts = []
+
+    def walk(node, top):
+        if isinstance(node.tag, str) and node.tag not in _SKIPPED_TEXT_TAGS:
+            parts.append(node.text)
+            for child in node:
+                walk(child, False)
+        if not top:
+            parts.append(node.tail)
+
+    walk(element, True)
+    return ''.join(part.strip() for part in parts if part and part.strip())
+
+class _CompiledAdapter:
+    """A SiteAdapter's CSS selectors translated to XPath once"""
+
+    def __init__(self, adapter):
+        translator = GenericTranslator()
+        self.headlines = etree.XPath(translator.css_to_xpath(adapter.headline_selector))
+        self.link = (etree.XPath(translator.css_to_xpath(adapter.link_selector, prefix='descendant::'))
+                     if adapter.link_selector else NEAREST_LINK)
+        self.is_body = etree.XPath(translator.css_to_xpath(adapter.body_selector, prefix='self::'))
+
+class LxmlExtractor:
+    """lxml extractor with each adapter's selectors precompiled to XPath.
+
+    Articles are fed to an incremental parser chunk by chunk and parsing
+    stops at the end of the first paragraph of the body container, so the
+    rest of the page is neither downloaded nor parsed.
+    """
+
+    name = 'lxml'
+
+    def __init__(self):
+        self._compiled = {}
+
+    def _compile(self, adapter):
+        compiled = self._compiled.get(adapter)
+        if compiled is None:
+            compiled = self._compiled[adapter] = _CompiledAdapter(adapter)
+        return compiled
+
+    def headlines(self, adapter, text):
+        if not text.strip():
+            return []
+        compiled = self._compile(adapter)
+        try:
+            root = lxml_html.document_fromstring(text)
+        except ValueError:
+            # lxml refuses str input that carries an XML encoding declaration
+            root = lxml_html.document_fromstring(text.encode('utf-8'))
+
+        headlines = []
+        for element in compiled.headlines(root):
+            links = compiled.link(element)
+            if not links:
+                continue
+            source = links[0] if adapter.link_selector else element
+            title = source.get(adapter.title_attribute, '') if adapter.title_attribute else _text(source)
+            headlines.append((title, links[0].get('href', '')))
+            if len(headlines) == adapter.max_headlines:
+                break
+        return headlines
+
+    def first_paragraph(self, adapter, chunks):
+        is_body = self._compile(adapter).is_body
+        parser = etree.HTMLPullParser(events=('start', 'end'))
+        container = None
+        for chunk in chunks:
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == 'start':
+                    if container is None and is_body(element):
+                        container = element
+                elif container is None:
+                    continue
+                elif element.tag == 'p' and any(ancestor is container for ancestor in element.iterancestors()):
+                    return _text(element)
+                elif element is container:
+                    # The body container closed without a paragraph
+                    return ""
+        parser.close()
+        return ""
+
+EXTRACTORS = {'soup': SoupExtractor}
+if etree is not None:
+    EXTRACTORS['lxml'] = LxmlExtractor
+
+def get_extractor(name: str = None):
+    """The extractor named by SCRAPE_PARSER, preferring lxml when it is installed"""
+    name = name or os.getenv("SCRAPE_PARSER") or ('lxml' if etree is not None else 'soup')
+    if name not in EXTRACTORS:
+        print(f"Unknown or unavailable SCRAPE_PARSER '{name}', using BeautifulSoup")
+        name = 'soup'
+    return EXTRACTORS[name]()
+
+def decode_chunks(response, chunk_size: int = 16 * 1024, deadline: float = None):
+    """Yield a streamed response's body as text, decoded the way response.text would.
+
+    Raises TimeoutError once the monotonic deadline passes, so a server
+    sending the body slowly cannot hold the reader past it.
+    """
+    encoding = response.encoding or response.apparent_encoding or 'utf-8'
+    try:
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    except LookupError:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError(f"Deadline passed while reading {response.url}")
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
@@ -1,12 +1,56 @@
 #%%
+import json
 import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
 import scrape_articles
+import metrics
+from keyword_cache import normalize_keywords
+from model_pool import ModelPool
+from rate_limit import RateLimiter, RateLimitExceeded
+from prediction_memo import reuse, entry
+from prompts import (ANALYST_ROLE, PREDICTION_SYSTEM, format_articles, keyword_prompt, individual_prompt,
+                     final_prompt, packed_prompt)
 
 load_dotenv()
 
 MY_ENV_VAR = os.getenv("api_key")
+# Per-source prediction calls allowed in flight at once for a single symbol
+PREDICTION_CONCURRENCY = int(os.getenv("PREDICTION_CONCURRENCY", "4"))
+# Gemini calls allowed in flight at once across the whole process
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+# Processes sharing the API key, each getting an equal share of the quota: the web workers
+# (WEB_CONCURRENCY, set by gunicorn.conf.py) plus standalone scheduler.py / jobs.py workers
+GEMINI_PROCESSES = max(1, int(os.getenv("GEMINI_PROCESSES") or
+                              int(os.getenv("WEB_CONCURRENCY", "1")) + int(os.getenv("GEMINI_WORKER_PROCESSES", "0"))))
+# Quota shared by every Gemini call in the process
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "60")) / GEMINI_PROCESSES
+GEMINI_TOKENS_PER_MINUTE = float(os.getenv("GEMINI_TOKENS_PER_MINUTE", "1000000")) / GEMINI_PROCESSES
+# Calls allowed to wait for quota before new ones are turned away
+GEMINI_MAX_QUEUE = int(os.getenv("GEMINI_MAX_QUEUE", "64"))
+# Seconds a call may wait for quota, and separately for Gemini to answer
+GEMINI_CALL_TIMEOUT = float(os.getenv("GEMINI_CALL_TIMEOUT", "60"))
+GEMINI_MAX_TOKENS = 1000
+# Items (one symbol's articles from one source, or one symbol's final call) answered per packed batch prompt
+BATCH_PACK_SIZE = int(os.getenv("BATCH_PACK_SIZE", "6"))
+
+# Runs the independent calls of a batch prediction
+_batch_executor = ThreadPoolExecutor(max_workers=PREDICTION_CONCURRENCY * 2, thread_name_prefix='batch-predict')
+
+_model_pool = None
+_model_pool_lock = threading.Lock()
+
+# Optional PredictionMemo so unchanged prompts reuse their last answer instead of calling Gemini
+prediction_memo = None
+# Memo name of the final call (source names are site adapter names)
+FINAL_MEMO = '_final'
+
+def set_prediction_memo(memo):
+  global prediction_memo
+  prediction_memo = memo
 
 def model_setup():
     if 'GOOGLE_API_KEY' not in os.environ:
@@ -15,41 +59,266 @@ def model_setup():
     model = ChatGoogleGenerativeAI(
       model='gemini-1.5-flash',
       temperature=0,
-      max_tokens=1000,
-      timeout=None,
+      max_tokens=GEMINI_MAX_TOKENS,
+      timeout=GEMINI_CALL_TIMEOUT,
       max_retries=2,
     )
 
     return model
   
+def get_model():
+    """Process-wide ModelPool around a single model_setup() client"""
+    global _model_pool
+    if _model_pool is None:
+      with _model_pool_lock:
+        if _model_pool is None:
+          limiter = RateLimiter(GEMINI_REQUESTS_PER_MINUTE, GEMINI_TOKENS_PER_MINUTE, max_queue=GEMINI_MAX_QUEUE)
+          _model_pool = ModelPool(model_setup, max_concurrency=GEMINI_MAX_CONCURRENCY, limiter=limiter,
+                                  call_timeout=GEMINI_CALL_TIMEOUT, max_output_tokens=GEMINI_MAX_TOKENS)
+    return _model_pool
+
 def generate_key_words(stock, model):
-    response = model.invoke(f""" 
-                            You are an expert in the stock market and are responsible for generating the 5 most relevant words to a given stock abbreviation. These keywords should be words that would appear in a news headline and should not be plural.
-                            Here are step by step examples of how to generate the key words:
-                            Example 1: TSLA
-                            'electric', 'car', 'Elon Musk', 'AI', 'autodrive'
-                            Example 2: NVDA
-                            'AI', 'GPU', 'technology', 'infrastructure', 'data'
-                            Example 3: AMZN
-                            'cloud', 'e-commerce', 'prime', 'marketplace', 'business'
-
-                            Now it's your turn. give me 5 key words, and ONLY the key words. Example: {stock}
-                            """)
+  with metrics.span('keywords'):
+    response = model.invoke(keyword_prompt(stock))
     response = response.content
-    out = response.split(',')
+    out = normalize_keywords(response.split(','))
     out.append('tariff')
     out.append(stock)
-    return out
+    return normalize_keywords(out)
   
 def scrape_formatting(stock, model):
   words = generate_key_words(stock, model)
   aggregated = scrape_articles.scrape_news(words)
   res = {}
   for source, articles in aggregated.items():
-    formatted = ""
-    count = 1
-    for article in articles:
-        formatted = formatted + f"Article {str(count)}: {article['first_paragraph']}\n"
-        count += 1
-    res[source] = formatted
-  return res, aggregated
\ No newline at end of file
+    res[source] = format_articles(articles)
+  return res, aggregated
+
+def parse_prediction(text):
+  """Split a 'Prediction: ... Sentiment: ...' reply into (prediction, sentiment)"""
+  match = re.search(r'^\W*sentiment\W*:\W*(positive|negative|neutral)', text, re.IGNORECASE | re.MULTILINE)
+  if match:
+    sentiment = match.group(1).capitalize()
+    text = text[:match.start()]
+  else:
+    found = re.findall(r'\b(positive|negative|neutral)\b', text, re.IGNORECASE)
+    sentiment = found[-1].capitalize() if found else 'Neutral'
+  prediction = re.sub(r'^\W*prediction\W*:[\s*_]*', '', text.strip(), flags=re.IGNORECASE)
+  return prediction.strip(), sentiment
+
+def prediction_events(stock_symbol, model, keyword_source=generate_key_words):
+  """Run the prediction chain, yielding (event, data) pairs as each stage finishes.
+
+  Events arrive in order: 'keywords', one 'articles' per source, one
+  'prediction' per source as its model call completes, then 'final' with
+  the same aggregated dict run_prediction returns. keyword_source(stock, model)
+  supplies the headline keywords, e.g. a KeywordCache's get.
+
+  With a prediction memo set, a source whose prompt (its matched articles)
+  is the same as last run reuses its stored answer, and so does the final
+  call when no source answer changed.
+  """
+  words = keyword_source(stock_symbol, model)
+  yield 'keywords', words
+
+  aggregated = scrape_articles.scrape_news(words)
+  #dictionary mapping source to prompt. groups of 5
+  source_to_prompt = {}
+  for source, articles in aggregated.items():
+    source_to_prompt[source] = format_articles(articles)
+    yield 'articles', {'source': source, 'articles': articles}
+
+  # Sources whose articles are unchanged since the last run keep their last prediction
+  memo = prediction_memo.load(stock_symbol) if prediction_memo else {}
+  sources = list(source_to_prompt)
+  prompts = {source: individual_prompt(stock_symbol, source_to_prompt[source]) for source in sources}
+  results = {}
+  for source in sources:
+    answer = reuse(memo, source, prompts[source])
+    if answer is not None:
+      results[source] = answer
+      yield 'prediction', {'source': source, 'prediction': answer[0], 'sentiment': answer[1]}
+
+  # One round trip per remaining source, all at once; each reply carries its own sentiment
+  pending = [source for source in sources if source not in results]
+  for index, response in model.batch_as_completed([prompts[source] for source in pending],
+                                                  config={"max_concurrency": PREDICTION_CONCURRENCY}):
+    response, sentiment = parse_prediction(response.content)
+    results[pending[index]] = (response, sentiment)
+    yield 'prediction', {'source': pending[index], 'prediction': response, 'sentiment': sentiment}
+
+  final_input = ""
+  for count, source in enumerate(sources, 1):
+    response, sentiment = results[source]
+    final_input += f'Prediction {count}: {response}\nSentiment {count}: {sentiment} \n'
+  prompt = final_prompt(stock_symbol, final_input)
+  final = reuse(memo, FINAL_MEMO, prompt)
+  final_reused = final is not None
+  if not final_reused:
+    final = parse_prediction(model.invoke(prompt).content)
+  if prediction_memo and (pending or not final_reused):
+    prediction_memo.save(stock_symbol, dict({source: entry(prompts[source], results[source]) for source in sources},
+                                            **{FINAL_MEMO: entry(prompt, final)}))
+
+  aggregated['individual_predictions'] = {source: results[source] for source in sources}
+  aggregated['final_prediction'] = final
+  yield 'final', aggregated
+
+def replay_events(aggregated):
+  """Yield the events of an already finished run (keywords are not kept)"""
+  predictions = aggregated.get('individual_predictions', {})
+  for source, articles in aggregated.items():
+    if source not in ('individual_predictions', 'final_prediction'):
+      yield 'articles', {'source': source, 'articles': articles}
+  for source, (response, sentiment) in predictions.items():
+    yield 'prediction', {'source': source, 'prediction': response, 'sentiment': sentiment}
+  yield 'final', aggregated
+
+def parse_packed(text, ids):
+  """{id: (prediction, sentiment)} for every id the packed reply answered properly"""
+  start, end = text.find('{'), text.rfind('}')
+  try:
+    data = json.loads(text[start:end + 1])
+  except ValueError:
+    return {}
+  if not isinstance(data, dict):
+    return {}
+  answers = {}
+  for item_id in ids:
+    entry = data.get(item_id)
+    if isinstance(entry, dict) and isinstance(entry.get('prediction'), str) and entry['prediction'].strip():
+      sentiment = str(entry.get('sentiment', '')).strip().capitalize()
+      answers[item_id] = (entry['prediction'].strip(), sentiment if sentiment in ('Positive', 'Negative', 'Neutral') else 'Neutral')
+  return answers
+
+def _invoke_each(model, prompts):
+  """Invoke every prompt concurrently; returns each reply's text, or the exception it raised"""
+  futures = [metrics.submit(_batch_executor, model.invoke, prompt) for prompt in prompts]
+  replies = []
+  for future in futures:
+    try:
+      replies.append(future.result().content)
+    except Exception as e:
+      replies.append(e)
+  return replies
+
+def answer_packed(model, system, instruction, items, single_prompt):
+  """Answer items BATCH_PACK_SIZE to a prompt, asking single_prompt(id) for any a pack's reply missed.
+
+  A failed call (RateLimitExceeded first) is raised rather than retried item
+  by item, which would multiply the calls just when Gemini or its quota is struggling.
+  """
+  ids = list(items)
+  packs = [ids[i:i + BATCH_PACK_SIZE] for i in range(0, len(ids), BATCH_PACK_SIZE)]
+  prompts = [packed_prompt(system, instruction, {item_id: items[item_id] for item_id in pack}) if len(pack) > 1
+             else single_prompt(pack[0]) for pack in packs]
+  replies = _invoke_each(model, prompts)
+  failures = [reply for reply in replies if isinstance(reply, Exception)]
+  if failures:
+    raise next((e for e in failures if isinstance(e, RateLimitExceeded)), failures[0])
+
+  answers = {}
+  for pack, reply in zip(packs, replies):
+    if len(pack) > 1:
+      answers.update(parse_packed(reply, pack))
+    else:
+      answers[pack[0]] = parse_prediction(reply)
+
+  missing = [item_id for item_id in ids if item_id not in answers]
+  errors = {}
+  for item_id, reply in zip(missing, _invoke_each(model, [single_prompt(item_id) for item_id in missing])):
+    if isinstance(reply, Exception):
+      errors[item_id] = reply
+    else:
+      answers[item_id] = parse_prediction(reply)
+  return answers, errors
+
+def run_batch_prediction(stock_symbols, model, keyword_source=generate_key_words):
+  """run_prediction for many symbols at once, sharing one scrape and packing the model calls.
+
+  Every symbol's keywords are matched against a single headline snapshot,
+  each article is fetched once, and the per-source and final predictions
+  of different symbols share prompts, BATCH_PACK_SIZE items to a call.
+  As in prediction_events, answers whose prompt is unchanged come from the
+  prediction memo.
+  Returns (results, errors): the aggregated dict per symbol, and an error
+  message for each symbol that could not be predicted. A failed packed
+  call fails the whole batch.
+  """
+  errors = {}
+  keywords = {}
+  for symbol, words in zip(stock_symbols, [metrics.submit(_batch_executor, keyword_source, symbol, model)
+                                           for symbol in stock_symbols]):
+    try:
+      keywords[symbol] = words.result()
+    except Exception as e:
+      errors[symbol] = str(e)
+
+  scraped = scrape_articles.scrape_news_batch(keywords)
+
+  memos = {symbol: prediction_memo.load(symbol) if prediction_memo else {} for symbol in scraped}
+  inputs = {f"{symbol}/{source}": format_articles(articles)
+            for symbol, sites in scraped.items() for source, articles in sites.items()}
+  single_prompts = {item_id: individual_prompt(item_id.rsplit('/', 1)[0], text) for item_id, text in inputs.items()}
+  # Items whose articles are unchanged since the last run keep their last prediction
+  reused = {}
+  for item_id, prompt in single_prompts.items():
+    symbol, source = item_id.rsplit('/', 1)
+    answer = reuse(memos[symbol], source, prompt)
+    if answer is not None:
+      reused[item_id] = answer
+  individual, failed = answer_packed(
+    model,
+    PREDICTION_SYSTEM,
+    "Each id below is a stock symbol and a news source, followed by that source's recent articles. For each id, "
+    "write a 50-word prediction as to how the articles might affect that stock in the short term.",
+    {item_id: text for item_id, text in inputs.items() if item_id not in reused},
+    single_prompts.get)
+  # Symbols with any new answer get their memo rewritten below
+  changed = {item_id.rsplit('/', 1)[0] for item_id in individual}
+  individual.update(reused)
+
+  final_inputs = {}
+  for symbol, sites in scraped.items():
+    missing = [source for source in sites if f"{symbol}/{source}" in failed]
+    if missing:
+      errors[symbol] = str(failed[f"{symbol}/{missing[0]}"])
+      continue
+    final_input = ""
+    for count, source in enumerate(sites, 1):
+      response, sentiment = individual[f"{symbol}/{source}"]
+      final_input += f'Prediction {count}: {response}\nSentiment {count}: {sentiment} \n'
+    final_inputs[symbol] = final_input
+  reused = {}
+  for symbol, final_input in final_inputs.items():
+    answer = reuse(memos[symbol], FINAL_MEMO, final_prompt(symbol, final_input))
+    if answer is not None:
+      reused[symbol] = answer
+  finals, failed = answer_packed(
+    model,
+    ANALYST_ROLE,
+    "Each id below is a stock symbol followed by predictions about it. For each id, from all the information "
+    "provided, provide a 50-word final prediction about whether that stock will rise, fall, or remain the same and why.",
+    {symbol: final_input for symbol, final_input in final_inputs.items() if symbol not in reused},
+    lambda symbol: final_prompt(symbol, final_inputs[symbol]))
+
+  results = {}
+  for symbol in final_inputs:
+    if symbol in failed:
+      errors[symbol] = str(failed[symbol])
+      continue
+    aggregated = scraped[symbol]
+    aggregated['individual_predictions'] = {source: individual[f"{symbol}/{source}"] for source in aggregated}
+    aggregated['final_prediction'] = finals[symbol] if symbol in finals else reused[symbol]
+    results[symbol] = aggregated
+    if prediction_memo and (symbol in finals or symbol in changed):
+      memo = {source: entry(single_prompts[f"{symbol}/{source}"], individual[f"{symbol}/{source}"])
+              for source in aggregated['individual_predictions']}
+      memo[FINAL_MEMO] = entry(final_prompt(symbol, final_inputs[symbol]), aggregated['final_prediction'])
+      prediction_memo.save(symbol, memo)
+  return results, errors
+
+def run_prediction(stock_symbol, model, keyword_source=generate_key_words):
+  for event, data in prediction_events(stock_symbol, model, keyword_source):
+    if event == 'final':
+      return data
@@ -0,0 +1,56 @@
+"""Production server settings: gunicorn -c gunicorn.conf.py wsgi:app
+
+Predictions spend tens of seconds waiting on news sites and Gemini, so
+each worker process serves many requests on threads rather than one at a
+time. Every setting can be overridden from the environment or .env.
+"""
+import multiprocessing
+import os
+import tempfile
+from dotenv import load_dotenv
+
+# The master reads these settings before any worker imports the app (which loads .env itself)
+load_dotenv()
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "gthread"
+# Requests served at once per worker. Open /api/predict/stream and /api/analyses/subscribe
+# connections each hold a thread; subscriptions are capped at ANALYSIS_MAX_SUBSCRIBERS
+# (half of these threads by default), so size this for the dashboards kept open per worker
+threads = int(os.getenv("GUNICORN_THREADS", "64"))
+
+# Long enough for a cold prediction; SSE streams send events well within it
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+# In-flight predictions get this long to finish on shutdown or reload
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "60"))
+keepalive = 5
+
+# Each worker imports the app after forking so MongoClient, the Gemini pool
+# and the scraper thread pools are never inherited across a fork
+preload_app = False
+
+accesslog = "-"
+errorlog = "-"
+
+# The Gemini quota is per API key: workers split it by the process count (see GEMINI_PROCESSES)
+os.environ["WEB_CONCURRENCY"] = str(workers)
+# The default cap on /api/analyses/subscribe streams is derived from it
+os.environ["GUNICORN_THREADS"] = str(threads)
+# Each worker keeps its own metrics; they are written here so any worker's /metrics reports the sum
+if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(tempfile.gettempdir(), "stocker-metrics")
+
+def on_starting(server):
+    # Counters left by a previous run would be added to this one's
+    from metrics import clear_multiprocess
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+    clear_multiprocess(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+def child_exit(server, worker):
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid, os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+def worker_exit(server, worker):
+    from app import shutdown
+    shutdown()
@@ -0,0 +1,190 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, ReturnDocument
+from prediction_cache import normalize_symbol
+from db_indexes import as_utc
+import metrics
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+def job_view(doc):
+    """A job document as returned by the jobs API"""
+    view = {
+        "id": str(doc["_id"]),
+        "symbol": doc["symbol"],
+        "status": doc["status"],
+    }
+    for field in ("createdAt", "startedAt", "finishedAt"):
+        if isinstance(doc.get(field), datetime):
+            view[field] = as_utc(doc[field]).isoformat()
+    if doc["status"] == DONE:
+        view["results"] = doc.get("results")
+    elif doc["status"] == FAILED:
+        view["message"] = doc.get("message")
+    return view
+
+class JobQueue:
+    """Prediction jobs stored in a MongoDB collection and run by a bounded pool.
+
+    While a job for a symbol is queued or running it holds activeKey (the
+    symbol, under a unique index), so submitting the same symbol again
+    returns that job instead of queueing another, from any process.
+
+    run(symbol) computes a job's results. Jobs are claimed from the
+    collection, so they can run on this process's workers (in_process) or
+    on standalone `python jobs.py` workers. A running job whose worker
+    died is claimed again once it has been running for stale_after seconds:
+    by the next submit for its symbol, or by the in-process sweep that
+    start() runs every sweep_seconds (which also picks up jobs left queued
+    by a restart).
+    """
+
+    def __init__(self, collection, run, workers: int = 4, in_process: bool = True,
+                 stale_after: int = 600, poll_seconds: int = 2, sweep_seconds: int = 60):
+        self.collection = collection
+        self.run = run
+        self.workers = workers
+        self.in_process = in_process
+        self.stale_after = stale_after
+        self.poll_seconds = poll_seconds
+        self.sweep_seconds = sweep_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='jobs')
+        self._stop = threading.Event()
+
+    def submit(self, symbol: str):
+        """Queue a prediction for the symbol, or return the job already pending for it"""
+        key = normalize_symbol(symbol)
+        doc = self.collection.find_one_and_update(
+            {"activeKey": key},
+            {"$setOnInsert": {"symbol": key, "status": QUEUED, "createdAt": datetime.now(timezone.utc)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if self.in_process and (doc["status"] == QUEUED or self._is_stale(doc)):
+            metrics.submit(self._executor, self.work_one, doc["_id"])
+        return doc
+
+    def _is_stale(self, doc) -> bool:
+        return (doc["status"] == RUNNING and isinstance(doc.get("startedAt"), datetime)
+                and as_utc(doc["startedAt"]) < datetime.now(timezone.utc) - timedelta(seconds=self.stale_after))
+
+    def get(self, job_id: str):
+        try:
+            return self.collection.find_one({"_id": ObjectId(job_id)})
+        except InvalidId:
+            return None
+
+    def _claimable(self, now):
+        return {"$or": [
+            {"status": QUEUED},
+            {"status": RUNNING, "startedAt": {"$lt": now - timedelta(seconds=self.stale_after)}},
+        ]}
+
+    def claim(self, job_id=None):
+        """Atomically take the given job, or the oldest queued (or stale running) one, or return None"""
+        now = datetime.now(timezone.utc)
+        query = self._claimable(now)
+        if job_id is not None:
+            query["_id"] = job_id
+        return self.collection.find_one_and_update(
+            query,
+            {"$set": {"status": RUNNING, "startedAt": now}},
+            sort=[("createdAt", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def work_one(self, job_id=None) -> bool:
+        """Run one claimed job to completion. Returns False when nothing was claimable"""
+        job = self.claim(job_id)
+        if job is None:
+            return False
+        try:
+            with metrics.span('job'):
+                update = {"status": DONE, "results": self.run(job["symbol"])}
+        except Exception as e:
+            print(f"Prediction job {job['_id']} for {job['symbol']} failed: {e}")
+            update = {"status": FAILED, "message": str(e)}
+        update["finishedAt"] = datetime.now(timezone.utc)
+        # Unsetting activeKey lets the next submit for the symbol start a new job
+        self.collection.update_one({"_id": job["_id"]}, {"$set": update, "$unset": {"activeKey": ""}})
+        return True
+
+    def run_forever(self):
+        """Standalone worker loop: keep every pool thread busy with claimed jobs"""
+        def worker():
+            while not self._stop.is_set():
+                try:
+                    if not self.work_one():
+                        self._stop.wait(self.poll_seconds)
+                except Exception as e:
+                    print(f"Job worker error: {e}")
+                    self._stop.wait(self.poll_seconds)
+
+        futures = [self._executor.submit(worker) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def start(self):
+        """In-process mode: periodically run jobs nobody is working on (lost by a restart or a dead worker)"""
+        if self.in_process:
+            threading.Thread(target=self._sweep_forever, name='jobs-sweep', daemon=True).start()
+        return self
+
+    def _sweep_forever(self):
+        while not self._stop.wait(self.sweep_seconds):
+            try:
+                if self.collection.find_one(self._claimable(datetime.now(timezone.utc)), {"_id": 1}) is not None:
+                    metrics.submit(self._executor, self._drain)
+            except Exception as e:
+                print(f"Job sweep error: {e}")
+
+    def _drain(self):
+        while not self._stop.is_set() and self.work_one():
+            pass
+
+    def stop(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+def from_env(collection, run) -> JobQueue:
+    """Build the queue from JOB_WORKERS / JOB_IN_PROCESS / JOB_STALE_SECONDS"""
+    return JobQueue(
+        collection,
+        run,
+        workers=int(os.getenv("JOB_WORKERS", "4")),
+        in_process=os.getenv("JOB_IN_PROCESS", "true").lower() == "true",
+        stale_after=int(os.getenv("JOB_STALE_SECONDS", "600")),
+        sweep_seconds=int(os.getenv("JOB_SWEEP_SECONDS", "60")),
+    )
+
+if __name__ == '__main__':
+    # Standalone job worker: python jobs.py (set JOB_IN_PROCESS=false on the web servers)
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+    from db_indexes import ensure_indexes
+    from gemini_calls import run_prediction, get_model, generate_key_words
+    from prediction_cache import from_env as prediction_cache_from_env
+    from keyword_cache import from_env as keyword_cache_from_env
+    from article_store import from_env as article_store_from_env
+    import scrape_articles
+    import gemini_calls
+    from prediction_memo import PredictionMemo
+
+    load_dotenv()
+    db = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017/"), event_listeners=[metrics.MongoListener()]).stockerdb
+    ensure_indexes(db)
+    scrape_articles.set_article_store(article_store_from_env(db.articles))
+    gemini_calls.set_prediction_memo(PredictionMemo(db.predictions))
+    prediction_cache = prediction_cache_from_env(db.predictions)
+    keyword_cache = keyword_cache_from_env(generate_key_words, db.keywords)
+    queue = from_env(db.jobs, lambda symbol: prediction_cache.get_or_compute(
+        symbol, lambda: run_prediction(symbol, get_model(), keyword_cache.get)))
+    print("Prediction job worker started")
+    try:
+        queue.run_forever()
+    except KeyboardInterrupt:
+        queue.stop()
@@ -0,0 +1,126 @@
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+from prediction_cache import normalize_symbol
+import metrics
+
+QUOTE_CHARS = "'\"`‘’“”"
+
+def normalize_keywords(words):
+    """Strip whitespace, quotes and list punctuation; drop empties and duplicates"""
+    out = []
+    seen = set()
+    for word in words:
+        word = word.strip().strip(QUOTE_CHARS + '[]().;:-*').strip()
+        if word and word.lower() not in seen:
+            seen.add(word.lower())
+            out.append(word)
+    return out
+
+class KeywordCache:
+    """Headline keywords per ticker, kept in memory and in MongoDB.
+
+    Keywords older than max_age are regenerated with generate(stock, model);
+    until then every prediction reuses them without a Gemini call.
+    """
+
+    def __init__(self, generate, collection=None, max_age: int = 3 * 24 * 60 * 60):
+        self.generate = generate
+        self.collection = collection
+        self.max_age = max_age
+        self._memory = {}  # symbol -> (generated_at, keywords)
+        self._lock = threading.Lock()
+        self._symbol_locks = {}
+
+    def get(self, stock, model):
+        """Return the keywords for the stock, generating them if missing or stale"""
+        key = normalize_symbol(stock)
+        keywords = self._lookup(key)
+        if keywords is not None:
+            metrics.cache_result('keywords', 'hit')
+            return keywords
+        metrics.cache_result('keywords', 'miss')
+
+        # Only one thread regenerates a given symbol; the rest wait and reuse it
+        with self._lock:
+            symbol_lock = self._symbol_locks.setdefault(key, threading.Lock())
+        with symbol_lock:
+            keywords = self._lookup(key)
+            if keywords is None:
+                keywords = self.refresh(key, model)
+        return keywords
+
+    def refresh(self, stock, model):
+        key = normalize_symbol(stock)
+        keywords = normalize_keywords(self.generate(key, model))
+        generated_at = datetime.now()
+        with self._lock:
+            self._memory[key] = (generated_at, keywords)
+        if self.collection is not None:
+            try:
+                self.collection.update_one(
+                    {"symbol": key},
+                    {"$set": {"symbol": key, "keywords": keywords, "generatedAt": generated_at}},
+                    upsert=True,
+                )
+            except Exception as e:
+                print(f"Error saving keywords for {key}: {e}")
+        return keywords
+
+    def warm(self, symbols, model):
+        """Make sure every symbol has fresh keywords. Returns how many were generated"""
+        generated = 0
+        for symbol in {normalize_symbol(s) for s in symbols}:
+            if self._lookup(symbol) is None:
+                try:
+                    self.refresh(symbol, model)
+                    generated += 1
+                except Exception as e:
+                    print(f"Error generating keywords for {symbol}: {e}")
+        return generated
+
+    def _lookup(self, key):
+        cutoff = datetime.now() - timedelta(seconds=self.max_age)
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is not None and entry[0] > cutoff:
+            return entry[1]
+
+        if self.collection is None:
+            return None
+        try:
+            doc = self.collection.find_one({"symbol": key, "generatedAt": {"$gt": cutoff}})
+        except Exception as e:
+            print(f"Error reading keywords for {key}: {e}")
+            return None
+        if doc is None:
+            return None
+        with self._lock:
+            self._memory[key] = (doc["generatedAt"], doc["keywords"])
+        return doc["keywords"]
+
+def from_env(generate, collection=None) -> KeywordCache:
+    """Build the cache from KEYWORD_REFRESH_SECONDS"""
+    return KeywordCache(generate, collection=collection,
+                        max_age=int(os.getenv("KEYWORD_REFRESH_SECONDS", str(3 * 24 * 60 * 60))))
+
+if __name__ == '__main__':
+    # Generate keywords for every symbol users follow: python keyword_cache.py warm
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+    from gemini_calls import generate_key_words, get_model
+    from scheduler import stock_symbol
+    from rate_limit import BACKGROUND
+
+    if sys.argv[1:] != ['warm']:
+        print("Usage: python keyword_cache.py warm")
+        sys.exit(1)
+
+    load_dotenv()
+    db = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017/")).stockerdb
+    symbols = {stock_symbol(item) for user in db.users.find({}, {"stocks": 1}) for item in user.get('stocks', [])}
+    symbols.discard(None)
+    cache = from_env(generate_key_words, db.keywords)
+    generated = cache.warm(symbols, get_model().with_priority(BACKGROUND))
+    print(f"Keywords ready for {len(symbols)} symbol(s), {generated} generated")
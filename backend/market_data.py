@@ -0,0 +1,281 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time as dtime, timedelta
+from zoneinfo import ZoneInfo
+import requests
+from pymongo import ASCENDING, UpdateOne
+from prediction_cache import normalize_symbol
+from rate_limit import RateLimitExceeded
+import metrics
+
+POLYGON_API_BASE_URL = "https://api.polygon.io"
+# Polygon's aggregate dates are New York calendar days
+MARKET_TZ = ZoneInfo("America/New_York")
+TIMESPANS = ('minute', 'hour', 'day', 'week', 'month', 'quarter', 'year')
+# Seconds an unknown ticker is remembered as invalid before Polygon is asked again
+INVALID_TICKER_TTL = 60 * 60
+
+class MarketDataError(Exception):
+    """Polygon could not answer and nothing usable was stored"""
+
+def day_bounds(start: date, end: date):
+    """Millisecond timestamps covering the New York days start..end inclusive"""
+    low = datetime.combine(start, dtime.min, MARKET_TZ)
+    high = datetime.combine(end + timedelta(days=1), dtime.min, MARKET_TZ)
+    return int(low.timestamp() * 1000), int(high.timestamp() * 1000)
+
+def market_today() -> date:
+    return datetime.now(MARKET_TZ).date()
+
+class MarketData:
+    """Polygon market data shared by every user, stored in MongoDB.
+
+    - Ticker reference data (name, market) is kept for reference_ttl seconds.
+    - Aggregate bars are stored one document per bar. bar_ranges records the
+      span of days already fetched for each (symbol, timespan); a request
+      only fetches the days outside it. Days before the day a range was last
+      fetched are final. The last day may still have been trading, so it is
+      fetched again once the range is older than bars_ttl seconds.
+    - Previous-day aggregates are kept for prev_ttl seconds.
+
+    Concurrent requests for the same data in one process wait for a single
+    upstream call. When Polygon fails, stale stored data is served instead.
+    """
+
+    def __init__(self, db, api_key: str, reference_ttl: int = 7 * 24 * 60 * 60,
+                 bars_ttl: int = 300, prev_ttl: int = 900, base_url: str = POLYGON_API_BASE_URL):
+        self.tickers = db.tickers
+        self.bars = db.bars
+        self.bar_ranges = db.bar_ranges
+        self.api_key = api_key
+        self.reference_ttl = reference_ttl
+        self.bars_ttl = bars_ttl
+        self.prev_ttl = prev_ttl
+        self.base_url = base_url
+        self.session = requests.Session()
+        # Sent as a header so the key never appears in URLs or error messages
+        self.session.headers['Authorization'] = f"Bearer {api_key}"
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='market-data')
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _key_lock(self, *key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _get(self, path, **params):
+        """GET a Polygon endpoint (a path, or a full next_url); None when it does not know the ticker"""
+        if not self.api_key:
+            raise MarketDataError("POLYGON_API_KEY is not set")
+        url = path if path.startswith('http') else f"{self.base_url}{path}"
+        with metrics.span('polygon'):
+            try:
+                response = self.session.get(url, params=params, timeout=10)
+            except requests.RequestException as e:
+                raise MarketDataError(f"Polygon request failed: {e}")
+        if response.status_code == 404:
+            return None
+        if response.status_code == 429:
+            raise RateLimitExceeded("Polygon rate limit reached", float(response.headers.get('Retry-After', 60)))
+        if not response.ok:
+            raise MarketDataError(f"Polygon returned {response.status_code} for {path}")
+        return response.json()
+
+    # Ticker reference data
+
+    def ticker(self, symbol: str):
+        """{"symbol", "valid", "name", "market"} for the symbol"""
+        key = normalize_symbol(symbol)
+        doc = self._stored_ticker(key)
+        if doc is not None and self._fresh_ticker(doc):
+            metrics.cache_result('tickers', 'hit')
+            return ticker_view(doc)
+        metrics.cache_result('tickers', 'miss')
+
+        with self._key_lock('ticker', key):
+            doc = self._stored_ticker(key)
+            if doc is not None and self._fresh_ticker(doc):
+                return ticker_view(doc)
+            try:
+                return ticker_view(self._fetch_ticker(key))
+            except (MarketDataError, RateLimitExceeded) as e:
+                if doc is None or "fetchedAt" not in doc:
+                    raise
+                print(f"Serving stored reference data for {key}: {e}")
+                return ticker_view(doc)
+
+    def ticker_batch(self, symbols):
+        """ticker() for many symbols: one stored read, and the misses fetched in parallel.
+        Returns (results, errors) keyed by symbol"""
+        keys = list(dict.fromkeys(normalize_symbol(symbol) for symbol in symbols))
+        results = {}
+        try:
+            for doc in self.tickers.find({"symbol": {"$in": keys}}):
+                if self._fresh_ticker(doc):
+                    results[doc["symbol"]] = ticker_view(doc)
+        except Exception as e:
+            print(f"Error reading tickers: {e}")
+        for _ in results:
+            metrics.cache_result('tickers', 'hit')
+
+        errors = {}
+        missing = [key for key in keys if key not in results]
+        futures = {key: metrics.submit(self._executor, self.ticker, key) for key in missing}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                errors[key] = str(e)
+        return {key: results[key] for key in keys if key in results}, errors
+
+    def _stored_ticker(self, key):
+        try:
+            return self.tickers.find_one({"symbol": key})
+        except Exception as e:
+            print(f"Error reading ticker {key}: {e}")
+            return None
+
+    def _fresh_ticker(self, doc) -> bool:
+        ttl = self.reference_ttl if doc.get("valid") else min(self.reference_ttl, INVALID_TICKER_TTL)
+        return doc.get("fetchedAt") is not None and doc["fetchedAt"] > datetime.now() - timedelta(seconds=ttl)
+
+    def _fetch_ticker(self, key):
+        data = self._get(f"/v3/reference/tickers/{key}")
+        results = (data or {}).get("results") or {}
+        doc = {
+            "symbol": key,
+            "valid": bool(results),
+            "name": results.get("name") or key,
+            "market": results.get("market") or 'Unknown',
+            "fetchedAt": datetime.now(),
+        }
+        self._save(self.tickers, {"symbol": key}, {"$set": doc})
+        return doc
+
+    # Previous-day aggregates
+
+    def previous_close(self, symbol: str):
+        """The symbol's previous trading day bar, or None"""
+        key = normalize_symbol(symbol)
+        cutoff = datetime.now() - timedelta(seconds=self.prev_ttl)
+        doc = self._stored_ticker(key)
+        if doc is not None and doc.get("prevFetchedAt") and doc["prevFetchedAt"] > cutoff:
+            metrics.cache_result('previous_close', 'hit')
+            return doc.get("prev")
+        metrics.cache_result('previous_close', 'miss')
+
+        with self._key_lock('prev', key):
+            doc = self._stored_ticker(key)
+            if doc is not None and doc.get("prevFetchedAt") and doc["prevFetchedAt"] > cutoff:
+                return doc.get("prev")
+            try:
+                data = self._get(f"/v2/aggs/ticker/{key}/prev")
+            except (MarketDataError, RateLimitExceeded) as e:
+                if doc is None or "prev" not in doc:
+                    raise
+                print(f"Serving stored previous close for {key}: {e}")
+                return doc["prev"]
+            prev = ((data or {}).get("results") or [None])[0]
+            self._save(self.tickers, {"symbol": key}, {"$set": {"prev": prev, "prevFetchedAt": datetime.now()}})
+            return prev
+
+    # Aggregate bars
+
+    def bars_between(self, symbol: str, start: date, end: date, timespan: str = 'day'):
+        """Polygon-shaped bars (t, o, h, l, c, v, vw, n) for the days start..end, oldest first"""
+        if timespan not in TIMESPANS:
+            raise ValueError(f"Timespan must be one of {', '.join(TIMESPANS)}")
+        if start > end:
+            raise ValueError("The start date must not be after the end date")
+        key = normalize_symbol(symbol)
+        end = min(end, market_today())
+
+        if not self._missing_days(key, timespan, start, end):
+            metrics.cache_result('bars', 'hit')
+        else:
+            metrics.cache_result('bars', 'miss')
+            with self._key_lock('bars', key, timespan):
+                # Another request may have filled the range while this one waited
+                missing = self._missing_days(key, timespan, start, end)
+                if missing:
+                    try:
+                        self._fetch_bars(key, timespan, missing, start, end)
+                    except (MarketDataError, RateLimitExceeded) as e:
+                        if not self._has_range(key, timespan):
+                            raise
+                        print(f"Serving stored bars for {key} {timespan}: {e}")
+
+        low, high = day_bounds(start, end)
+        return list(self.bars.find({"symbol": key, "timespan": timespan, "t": {"$gte": low, "$lt": high}},
+                                   {"_id": 0, "symbol": 0, "timespan": 0}).sort("t", ASCENDING))
+
+    def _range(self, key, timespan):
+        return self.bar_ranges.find_one({"symbol": key, "timespan": timespan})
+
+    def _has_range(self, key, timespan) -> bool:
+        return self._range(key, timespan) is not None
+
+    def _missing_days(self, key, timespan, start: date, end: date):
+        """(from, to) day spans of start..end that must be fetched, [] when the store covers it"""
+        stored = self._range(key, timespan)
+        if stored is None:
+            return [(start, end)]
+        stored_start = date.fromisoformat(stored["start"])
+        stored_end = date.fromisoformat(stored["end"])
+        # Days before the fetch day had closed when they were fetched
+        final_through = min(stored_end, date.fromisoformat(stored["fetchedOn"]) - timedelta(days=1))
+        spans = []
+        if start < stored_start:
+            spans.append((start, stored_start - timedelta(days=1)))
+        stale = stored["fetchedAt"] < datetime.now() - timedelta(seconds=self.bars_ttl)
+        if end > stored_end or (end > final_through and stale):
+            # Extend from the stored range so it stays contiguous
+            spans.append((final_through + timedelta(days=1), end))
+        return spans
+
+    def _fetch_bars(self, key, timespan, spans, start: date, end: date):
+        stored = self._range(key, timespan)
+        fetched_on, fetched_at = market_today(), datetime.now()
+        for span_start, span_end in spans:
+            data = self._get(f"/v2/aggs/ticker/{key}/range/1/{timespan}/{span_start.isoformat()}/{span_end.isoformat()}",
+                             adjusted="true", sort="asc", limit=50000)
+            while data:
+                results = data.get("results") or []
+                if results:
+                    self.bars.bulk_write([
+                        UpdateOne({"symbol": key, "timespan": timespan, "t": bar["t"]},
+                                  {"$set": {**bar, "symbol": key, "timespan": timespan}}, upsert=True)
+                        for bar in results
+                    ], ordered=False)
+                # Long minute ranges come back in pages
+                data = self._get(data["next_url"]) if data.get("next_url") else None
+        if stored is not None:
+            start = min(start, date.fromisoformat(stored["start"]))
+            end = max(end, date.fromisoformat(stored["end"]))
+        self._save(self.bar_ranges, {"symbol": key, "timespan": timespan},
+                   {"$set": {"start": start.isoformat(), "end": end.isoformat(),
+                             "fetchedOn": fetched_on.isoformat(), "fetchedAt": fetched_at}})
+
+    def _save(self, collection, query, update):
+        try:
+            collection.update_one(query, update, upsert=True)
+        except Exception as e:
+            print(f"Error saving market data to {collection.name}: {e}")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+def ticker_view(doc):
+    return {key: doc[key] for key in ("symbol", "valid", "name", "market")}
+
+def from_env(db) -> MarketData:
+    """Build the store from POLYGON_API_KEY / MARKET_REFERENCE_TTL / MARKET_BARS_TTL / MARKET_PREV_TTL"""
+    return MarketData(
+        db,
+        os.getenv("POLYGON_API_KEY", ""),
+        reference_ttl=int(os.getenv("MARKET_REFERENCE_TTL", str(7 * 24 * 60 * 60))),
+        bars_ttl=int(os.getenv("MARKET_BARS_TTL", "300")),
+        prev_ttl=int(os.getenv("MARKET_PREV_TTL", "900")),
+    )
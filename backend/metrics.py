@@ -0,0 +1,254 @@
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pymongo import monitoring
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+_gauges = {}      # name -> callable returning {labels: value}
+
+# Set by start_multiprocess(): directory where every server process writes its metrics
+_multiproc_dir = None
+_stop = threading.Event()
+
+# Spans recorded while handling the current request, for the Server-Timing header
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        series = _histograms.setdefault(key, [0] * (len(BUCKETS) + 2))
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+def register_gauge(name, collect):
+    """collect() returns {labels_dict_items_tuple: value} or a plain number"""
+    with _lock:
+        _gauges[name] = collect
+
+def record_span(stage, seconds, error=None, **labels):
+    observe('stocker_stage_duration_seconds', seconds, stage=stage, **labels)
+    if error is not None:
+        kind = 'timeout' if 'timeout' in type(error).__name__.lower() else 'error'
+        inc(f'stocker_stage_{kind}s_total', stage=stage, **labels)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+@contextmanager
+def span(stage, **labels):
+    """Time a block as one stage of the pipeline"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        record_span(stage, time.perf_counter() - start, error=e, **labels)
+        raise
+    record_span(stage, time.perf_counter() - start, **labels)
+
+def cache_result(cache, result):
+    inc('stocker_cache_requests_total', cache=cache, result=result)
+
+def submit(executor, fn, *args, **kwargs):
+    """executor.submit that keeps the caller's context, so worker spans reach its request"""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def start_request():
+    _request_spans.set([])
+
+def server_timing():
+    """Server-Timing header value summing the current request's spans per stage"""
+    spans = _request_spans.get()
+    if not spans:
+        return None
+    totals = {}
+    for stage, seconds in spans:
+        count, total = totals.get(stage, (0, 0.0))
+        totals[stage] = (count + 1, total + seconds)
+    return ", ".join(f'{stage};dur={total * 1000:.1f};desc="{count} call(s)"'
+                     for stage, (count, total) in totals.items())
+
+class MongoListener(monitoring.CommandListener):
+    """Times every MongoDB command issued through a client it is registered on"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        record_span('mongo', event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        record_span('mongo', event.duration_micros / 1e6, error=Exception(event.failure), command=event.command_name)
+
+def _labels(items):
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{str(v)}"' for k, v in items) + '}'
+
+def _collect_gauges(gauges):
+    """{(name, labels): value} from the registered gauge callables"""
+    collected = {}
+    for name, collect in sorted(gauges.items()):
+        try:
+            values = collect()
+        except Exception as e:
+            print(f"Error collecting gauge {name}: {e}")
+            continue
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            collected[(name, tuple(labels))] = value
+    return collected
+
+def _local():
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(series) for key, series in _histograms.items()}
+        gauges = dict(_gauges)
+    return counters, histograms, _collect_gauges(gauges)
+
+# Multiprocess mode
+#
+# gunicorn runs several worker processes and each /metrics scrape reaches
+# one of them, so every worker writes its metrics to a file in a shared
+# directory and render() reports the sum over all the files. Files of
+# exited workers are kept so counters never go backwards; their gauges are
+# dropped by mark_process_dead().
+
+def _process_file(directory, pid):
+    return os.path.join(directory, f'metrics_{pid}.json')
+
+def _write(path, counters, histograms, gauges):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({
+            "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+            "histograms": [[name, labels, series] for (name, labels), series in histograms.items()],
+            "gauges": [[name, labels, value] for (name, labels), value in gauges.items()],
+        }, f)
+    # Readers never see a half-written file
+    os.replace(tmp, path)
+
+def _read(path):
+    with open(path) as f:
+        data = json.load(f)
+    labels = lambda items: tuple(tuple(item) for item in items)
+    return tuple({(name, labels(items)): value for name, items, value in data[kind]}
+                 for kind in ("counters", "histograms", "gauges"))
+
+def flush():
+    """Write this process's metrics to the multiprocess directory, if one is set"""
+    if _multiproc_dir is not None:
+        _write(_process_file(_multiproc_dir, os.getpid()), *_local())
+
+def _flush_forever(seconds):
+    while not _stop.wait(seconds):
+        try:
+            flush()
+        except Exception as e:
+            print(f"Error writing metrics: {e}")
+
+def start_multiprocess(directory, flush_seconds: float = 5):
+    """Share this process's metrics through directory (a no-op when it is empty).
+
+    Other processes' values reach /metrics up to flush_seconds late.
+    """
+    global _multiproc_dir
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    _multiproc_dir = directory
+    flush()
+    threading.Thread(target=_flush_forever, args=(flush_seconds,), name='metrics-flush', daemon=True).start()
+
+def stop():
+    _stop.set()
+    try:
+        flush()
+    except Exception as e:
+        print(f"Error writing metrics: {e}")
+
+def mark_process_dead(pid, directory):
+    """Forget an exited process's gauges; its counters and histograms still count"""
+    path = _process_file(directory, pid)
+    if not os.path.exists(path):
+        return
+    try:
+        counters, histograms, _ = _read(path)
+        _write(path, counters, histograms, {})
+    except (OSError, ValueError) as e:
+        print(f"Error updating metrics of exited process {pid}: {e}")
+
+def clear_multiprocess(directory):
+    """Remove the files of a previous server run, called before any worker starts"""
+    for path in glob.glob(os.path.join(directory, 'metrics_*.json*')):
+        os.remove(path)
+
+def _aggregate(directory):
+    counters, histograms, gauges = {}, {}, {}
+    for path in glob.glob(os.path.join(directory, 'metrics_*.json')):
+        try:
+            file_counters, file_histograms, file_gauges = _read(path)
+        except (OSError, ValueError) as e:
+            print(f"Error reading metrics file {path}: {e}")
+            continue
+        for key, value in file_counters.items():
+            counters[key] = counters.get(key, 0) + value
+        for key, series in file_histograms.items():
+            total = histograms.setdefault(key, [0] * len(series))
+            histograms[key] = [a + b for a, b in zip(total, series)]
+        for key, value in file_gauges.items():
+            gauges[key] = gauges.get(key, 0) + value
+    return counters, histograms, gauges
+
+def render():
+    """All metrics in the Prometheus text exposition format (summed over processes in multiprocess mode)"""
+    if _multiproc_dir is not None:
+        flush()
+        counters, histograms, gauges = _aggregate(_multiproc_dir)
+    else:
+        counters, histograms, gauges = _local()
+
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f'# TYPE {name} counter')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_labels(labels)} {value}')
+
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f'# TYPE {name} histogram')
+        for (metric, labels), series in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, count in zip(BUCKETS, series):
+                lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {count}')
+            lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {series[-1]}')
+            lines.append(f'{name}_sum{_labels(labels)} {series[-2]}')
+            lines.append(f'{name}_count{_labels(labels)} {series[-1]}')
+
+    for name in sorted({name for name, _ in gauges}):
+        lines.append(f'# TYPE {name} gauge')
+        for (metric, labels), value in gauges.items():
+            if metric == name:
+                lines.append(f'{name}{_labels(labels)} {value}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rate_limit import INTERACTIVE, RateLimitExceeded, estimate_tokens
+import metrics
+
+class ModelPool:
+    """One chat model client shared by every request and background worker.
+
+    The client is built by factory() on first use. At most max_concurrency
+    calls run against it at once; the rest queue. invoke / batch /
+    batch_as_completed mirror the LangChain methods the prediction chain
+    uses, so the pool can be passed anywhere a model is expected.
+
+    With a RateLimiter, each call first waits for request and token budget
+    in priority order and gives up after call_timeout seconds.
+    """
+
+    def __init__(self, factory, max_concurrency: int = 8, latency_samples: int = 500,
+                 limiter=None, call_timeout: float = None, max_output_tokens: int = 0):
+        self.factory = factory
+        self.max_concurrency = max_concurrency
+        self.limiter = limiter
+        self.call_timeout = call_timeout
+        self.max_output_tokens = max_output_tokens
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix='model-pool')
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._waiting = 0
+        self._calls = 0
+        self._errors = 0
+        self._latencies = deque(maxlen=latency_samples)
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self.factory()
+        return self._model
+
+    def with_priority(self, priority: int):
+        """A view of the pool whose calls queue at the given priority"""
+        return _PriorityView(self, priority)
+
+    def invoke(self, input, config=None, priority: int = INTERACTIVE, **kwargs):
+        model = self.model
+        deadline = time.monotonic() + self.call_timeout if self.call_timeout else None
+        queued = time.monotonic()
+        if self.limiter is not None:
+            estimate = estimate_tokens(input, self.max_output_tokens)
+            self.limiter.acquire(estimate, priority, deadline)
+        with self._stats_lock:
+            self._waiting += 1
+        acquired = self._slots.acquire(timeout=max(0, deadline - time.monotonic()) if deadline else None)
+        with self._stats_lock:
+            self._waiting -= 1
+            if not acquired:
+                self._errors += 1
+                raise RateLimitExceeded("All Gemini slots stayed busy past the call deadline", 1.0)
+            self._in_flight += 1
+        start = time.monotonic()
+        metrics.record_span('llm_wait', start - queued)
+        try:
+            with metrics.span('llm'):
+                response = model.invoke(input, config, **kwargs)
+            usage = getattr(response, 'usage_metadata', None)
+            if self.limiter is not None and usage and usage.get('total_tokens'):
+                self.limiter.adjust(usage['total_tokens'] - estimate)
+            return response
+        except Exception:
+            with self._stats_lock:
+                self._errors += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            self._slots.release()
+            with self._stats_lock:
+                self._in_flight -= 1
+                self._calls += 1
+                self._latencies.append(elapsed)
+
+    def batch(self, inputs, config=None, priority: int = INTERACTIVE, **kwargs):
+        results = [None] * len(inputs)
+        for index, result in self.batch_as_completed(inputs, config, priority, **kwargs):
+            results[index] = result
+        return results
+
+    def batch_as_completed(self, inputs, config=None, priority: int = INTERACTIVE, **kwargs):
+        """Yield (index, result) for each input as its call finishes"""
+        # config's max_concurrency caps this batch on top of the pool-wide limit
+        limit = threading.BoundedSemaphore((config or {}).get("max_concurrency") or len(inputs) or 1)
+
+        def call(input):
+            with limit:
+                return self.invoke(input, priority=priority, **kwargs)
+
+        futures = {metrics.submit(self._executor, call, input): index for index, input in enumerate(inputs)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    def metrics(self):
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "queue_depth": self._waiting,
+                "calls": self._calls,
+                "errors": self._errors,
+            }
+        if self.limiter is not None:
+            stats.update(self.limiter.stats())
+        for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            stats[f"latency_{name}"] = latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else None
+        return stats
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+class _PriorityView:
+    """ModelPool calls pinned to one priority (e.g. background refreshes)"""
+
+    def __init__(self, pool, priority):
+        self.pool = pool
+        self.priority = priority
+
+    def invoke(self, input, config=None, **kwargs):
+        return self.pool.invoke(input, config, priority=self.priority, **kwargs)
+
+    def batch(self, inputs, config=None, **kwargs):
+        return self.pool.batch(inputs, config, priority=self.priority, **kwargs)
+
+    def batch_as_completed(self, inputs, config=None, **kwargs):
+        return self.pool.batch_as_completed(inputs, config, priority=self.priority, **kwargs)
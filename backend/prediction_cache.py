@@ -0,0 +1,264 @@
+import contextvars
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import metrics
+
+
+def normalize_symbol(symbol: str) -> str:
+    return symbol.strip().upper()
+
+
+class _InFlight:
+    """A computation that other callers for the same symbol can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class PredictionCache:
+    """Per-symbol prediction results shared by every user.
+
+    Lookups go to an in-memory LRU first, then to MongoDB (if a collection is
+    given), and only then run the pipeline. Concurrent misses for the same
+    symbol wait on a single in-flight computation instead of starting their own.
+    """
+
+    def __init__(self, collection=None, ttl: int = 300, max_size: int = 256):
+        self.collection = collection
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # symbol -> (expires_at, result)
+        self._in_flight = {}  # symbol -> _InFlight
+        self._lock = threading.Lock()
+
+    def get(self, symbol: str):
+        """Return a fresh cached result for the symbol, or None"""
+        key = normalize_symbol(symbol)
+        with self._lock:
+            result = self._get_memory(key)
+        if result is not None:
+            metrics.cache_result('prediction', 'hit_memory')
+            return result
+
+        doc = self._get_mongo(key)
+        if doc is None:
+            metrics.cache_result('prediction', 'miss')
+            return None
+        metrics.cache_result('prediction', 'hit_mongo')
+        # Only keep it in memory for whatever is left of its TTL
+        age = (datetime.now() - doc["lastUpdated"]).total_seconds()
+        with self._lock:
+            self._put_memory(key, doc["results"], time.monotonic() + self.ttl - age)
+        return doc["results"]
+
+    def set(self, symbol: str, result):
+        key = normalize_symbol(symbol)
+        with self._lock:
+            self._put_memory(key, result)
+        self._put_mongo(key, result)
+
+    def invalidate(self, symbol: str):
+        key = normalize_symbol(symbol)
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.collection is not None:
+            try:
+                self.collection.delete_one({"symbol": key})
+            except Exception as e:
+                print(f"Error invalidating cached prediction for {key}: {e}")
+
+    def get_or_compute(self, symbol: str, compute):
+        """Return the cached result for the symbol, computing it at most once"""
+        key = normalize_symbol(symbol)
+        cached, flight, leader = self._claim(key)
+        if cached is not None:
+            return cached
+        if not leader:
+            return self._wait(flight)
+
+        try:
+            flight.result = compute()
+            self.set(key, flight.result)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self._release(key, flight)
+
+    def get_or_compute_many(self, symbols, compute):
+        """get_or_compute for several symbols, computing the missing ones together.
+
+        compute(keys) is called once with the symbols no other caller is
+        already computing and returns (results, errors) keyed by symbol.
+        Symbols being computed elsewhere are waited on instead. Returns
+        (results, errors) for every symbol.
+        """
+        results, errors, leading, waiting = {}, {}, {}, {}
+        for key in dict.fromkeys(normalize_symbol(symbol) for symbol in symbols):
+            cached, flight, leader = self._claim(key)
+            if cached is not None:
+                results[key] = cached
+            elif leader:
+                leading[key] = flight
+            else:
+                waiting[key] = flight
+
+        if leading:
+            computed, failed = {}, {}
+            try:
+                computed, failed = compute(list(leading))
+                for key, result in computed.items():
+                    self.set(key, result)
+            except Exception as e:
+                for flight in leading.values():
+                    flight.error = e
+                raise
+            finally:
+                for key, flight in leading.items():
+                    if key in computed:
+                        flight.result = computed[key]
+                    elif flight.error is None:
+                        flight.error = RuntimeError(failed.get(key, f"No prediction for {key}"))
+                    self._release(key, flight)
+            results.update(computed)
+            errors.update(failed)
+
+        for key, flight in waiting.items():
+            try:
+                results[key] = self._wait(flight)
+            except Exception as e:
+                errors[key] = str(e)
+        return results, errors
+
+    def stream(self, symbol: str, start_events, replay_events):
+        """Stream (event, data) pairs for the symbol, running the pipeline at most once.
+
+        On a miss the events come live from start_events() and its 'final'
+        payload is cached; otherwise the finished result is passed through
+        replay_events.
+        """
+        key = normalize_symbol(symbol)
+        cached, flight, leader = self._claim(key)
+        if cached is not None:
+            yield from replay_events(cached)
+            return
+        if not leader:
+            yield from replay_events(self._wait(flight))
+            return
+
+        # The pipeline runs on its own thread so it still finishes, and other callers
+        # waiting on the symbol still get its result, if this stream's client disconnects
+        events = queue.Queue()
+
+        def run():
+            try:
+                for event, data in start_events():
+                    if event == 'final':
+                        flight.result = data
+                        self.set(key, data)
+                    events.put((event, data))
+                if flight.result is None:
+                    raise RuntimeError(f"Prediction stream for {key} ended without a final result")
+            except Exception as e:
+                flight.error = e
+            finally:
+                self._release(key, flight)
+                events.put(None)
+
+        threading.Thread(target=contextvars.copy_context().run, args=(run,),
+                         name=f'prediction-stream-{key}', daemon=True).start()
+        while True:
+            item = events.get()
+            if item is None:
+                break
+            yield item
+        if flight.error is not None:
+            raise flight.error
+
+    def _claim(self, key):
+        """Return (cached, flight, leader); the leader must compute and release"""
+        cached = self.get(key)
+        if cached is not None:
+            return cached, None, False
+        with self._lock:
+            # Another request may have finished while we were checking MongoDB
+            cached = self._get_memory(key)
+            if cached is not None:
+                return cached, None, False
+            flight = self._in_flight.get(key)
+            if flight is not None:
+                return None, flight, False
+            flight = _InFlight()
+            self._in_flight[key] = flight
+            return None, flight, True
+
+    def _wait(self, flight):
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _release(self, key, flight):
+        with self._lock:
+            self._in_flight.pop(key, None)
+        flight.done.set()
+
+    def _get_memory(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _put_memory(self, key, result, expires_at=None):
+        if expires_at is None:
+            expires_at = time.monotonic() + self.ttl
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _get_mongo(self, key):
+        if self.collection is None:
+            return None
+        try:
+            doc = self.collection.find_one(
+                {"symbol": key, "lastUpdated": {"$gt": datetime.now() - timedelta(seconds=self.ttl)}},
+                {"results": 1, "lastUpdated": 1},
+            )
+        except Exception as e:
+            print(f"Error reading cached prediction for {key}: {e}")
+            return None
+        return doc
+
+    def _put_mongo(self, key, result):
+        if self.collection is None:
+            return
+        try:
+            self.collection.update_one(
+                {"symbol": key},
+                {"$set": {"symbol": key, "results": result, "lastUpdated": datetime.now()}},
+                upsert=True,
+            )
+        except Exception as e:
+            print(f"Error saving cached prediction for {key}: {e}")
+
+
+def from_env(collection=None) -> PredictionCache:
+    """Build the cache from PREDICTION_CACHE_TTL / PREDICTION_CACHE_SIZE"""
+    return PredictionCache(
+        collection=collection,
+        ttl=int(os.getenv("PREDICTION_CACHE_TTL", "300")),
+        max_size=int(os.getenv("PREDICTION_CACHE_SIZE", "256")),
+    )
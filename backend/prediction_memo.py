@@ -0,0 +1,49 @@
+import hashlib
+from prediction_cache import normalize_symbol
+from prompts import prompt_text
+import metrics
+
+def fingerprint(prompt) -> str:
+    """Identifies a model call by its exact prompt (which embeds the symbol and articles)"""
+    return hashlib.sha256(prompt_text(prompt).encode('utf-8')).hexdigest()
+
+class PredictionMemo:
+    """Last (prediction, sentiment) per source and for the final call of each symbol.
+
+    Each answer is stored with the fingerprint of the prompt that produced
+    it. When a refresh builds the same prompt again (the matched articles
+    did not change) the stored answer is reused instead of calling Gemini.
+    Entries live in the symbol's predictions document under "memo" and
+    outlast the prediction cache TTL.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def load(self, symbol: str):
+        """{name: {"fingerprint", "prediction", "sentiment"}} saved for the symbol"""
+        try:
+            doc = self.collection.find_one({"symbol": normalize_symbol(symbol)}, {"memo": 1})
+        except Exception as e:
+            print(f"Error reading prediction memo for {symbol}: {e}")
+            return {}
+        return (doc or {}).get("memo") or {}
+
+    def save(self, symbol: str, memo):
+        try:
+            self.collection.update_one({"symbol": normalize_symbol(symbol)}, {"$set": {"memo": memo}}, upsert=True)
+        except Exception as e:
+            print(f"Error saving prediction memo for {symbol}: {e}")
+
+def reuse(memo, name: str, prompt):
+    """The stored (prediction, sentiment) for name if it came from this exact prompt, else None"""
+    entry = memo.get(name)
+    if entry and entry.get("fingerprint") == fingerprint(prompt):
+        metrics.cache_result('llm_memo', 'hit')
+        return entry["prediction"], entry["sentiment"]
+    metrics.cache_result('llm_memo', 'miss')
+    return None
+
+def entry(prompt, answer):
+    prediction, sentiment = answer
+    return {"fingerprint": fingerprint(prompt), "prediction": prediction, "sentiment": sentiment}
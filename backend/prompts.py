@@ -0,0 +1,85 @@
+"""Prompt templates for the prediction chain.
+
+Each prompt is a list of chat messages. The system message holds all the
+static text (role and few-shot examples) and is the same on every call;
+only the short human message changes from call to call.
+
+Nothing is cached between calls: gemini-1.5-flash has no implicit caching,
+and the ~550-token system prefix is below Gemini's minimum for explicit
+context caching. Prompt cost is kept down by the compacted examples and
+by format_articles' per-source token budget.
+"""
+import os
+
+# Rough characters per token, as in rate_limit.estimate_tokens
+CHARS_PER_TOKEN = 4
+# Tokens of article text sent per source; longer paragraphs are trimmed to fit
+ARTICLE_TOKEN_BUDGET = int(os.getenv("PROMPT_ARTICLE_TOKENS", "1200"))
+
+ANALYST_ROLE = ("You are an expert in the stock market and are responsible for informing clients about the "
+                "potential impact of recent events on particular stocks.")
+
+KEYWORD_SYSTEM = """You are an expert in the stock market and are responsible for generating the 5 most relevant words to a given stock abbreviation. These keywords should be words that would appear in a news headline and should not be plural.
+Examples:
+TSLA: 'electric', 'car', 'Elon Musk', 'AI', 'autodrive'
+NVDA: 'AI', 'GPU', 'technology', 'infrastructure', 'data'
+AMZN: 'cloud', 'e-commerce', 'prime', 'marketplace', 'business'
+Reply with the 5 key words only, comma separated."""
+
+PREDICTION_SYSTEM = f"""{ANALYST_ROLE}
+Examples of predictions based on one source's articles:
+
+Stock: TSLA
+Article 1: In the 2024 U.S. presidential election, former President Donald Trump defeated Vice President Kamala Harris, securing 312 electoral votes to Harris's 226. Trump also won the popular vote with 49.8% against Harris's 48.3%. This victory marked Trump's return to the White House for a non-consecutive second term.
+Article 2: BYD has opened a $490 million EV factory in Thailand and is building a $1 billion plant in Indonesia, set to finish by end of 2025. Each factory will produce 150,000 vehicles annually, supporting BYD's plan to double overseas sales to over 800,000 units by 2025.
+Prediction: Trump's return could boost U.S. manufacturing and deregulation, potentially favoring Tesla. However, BYD's aggressive global expansion may intensify EV competition. Combined, Tesla's stock may face short-term optimism from policy shifts but long-term pressure from rising international rivals like BYD, possibly resulting in increased volatility and mixed investor sentiment.
+
+Stock: NVDA
+Article 1: In the second quarter of fiscal 2025, NVIDIA reported record revenue of $30.0 billion, a 122% year-over-year increase, surpassing analyst expectations. Earnings per share reached $0.67, up 168% from the previous year. This growth was driven by strong demand for AI-related products, particularly in data centers.
+Article 2: President Trump, since his January 2025 inauguration, has implemented a range of new tariffs. Prior to leaving office in 2021, Trump was known for aggressive tariff policies, particularly targeting China, steel, aluminum, and various European goods.
+Prediction: NVIDIA's record-breaking Q2 performance, driven by AI demand, suggests strong upward momentum. However, Trump's new tariffs could disrupt global supply chains and raise costs, especially if China is targeted. Despite potential trade tensions, NVIDIA's dominance in AI may sustain investor confidence, keeping its stock resilient with possible short-term fluctuations."""
+
+SENTIMENT_FORMAT = ("Respond in exactly this format:\n"
+                    "Prediction: <your prediction>\n"
+                    "Sentiment: <Positive, Negative, or Neutral>")
+
+def _trim(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(' ', 1)[0]
+    return cut + '…'
+
+def format_articles(articles, token_budget: int = None):
+    """Number each article's first paragraph, trimming them to share token_budget evenly"""
+    budget = ARTICLE_TOKEN_BUDGET if token_budget is None else token_budget
+    per_article = budget * CHARS_PER_TOKEN // max(1, len(articles))
+    return "".join(f"Article {count}: {_trim(article['first_paragraph'], per_article)}\n"
+                   for count, article in enumerate(articles, 1))
+
+def keyword_prompt(stock):
+    return [("system", KEYWORD_SYSTEM), ("human", f"Stock: {stock}")]
+
+def individual_prompt(stock_symbol, articles_text):
+    return [("system", PREDICTION_SYSTEM),
+            ("human", f"Write a 50-word prediction as to how these articles might affect {stock_symbol} in the short term.\n"
+                      f"{SENTIMENT_FORMAT}\n\nStock: {stock_symbol}\n{articles_text}")]
+
+def final_prompt(stock_symbol, final_input):
+    return [("system", ANALYST_ROLE),
+            ("human", f"From all the information provided, provide a 50-word final prediction about whether you think the "
+                      f"{stock_symbol} stock will rise, fall, or remain the same and why.\n{SENTIMENT_FORMAT}\n{final_input}")]
+
+def packed_prompt(system, instruction, items):
+    """One prompt answering several items at once; items maps an id to its input"""
+    body = "\n\n".join(f"### {item_id}\n{text}" for item_id, text in items.items())
+    return [("system", system),
+            ("human", f"{instruction}\n"
+                      'Respond with only a JSON object mapping every id below to '
+                      '{"prediction": "<your prediction>", "sentiment": "<Positive, Negative, or Neutral>"}.\n\n'
+                      f"{body}")]
+
+def prompt_text(prompt) -> str:
+    """A prompt's full text, whether a plain string or a list of (role, content) messages"""
+    if isinstance(prompt, str):
+        return prompt
+    return "\n".join(f"{role}: {content}" for role, content in prompt)
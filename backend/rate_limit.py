@@ -0,0 +1,106 @@
+import heapq
+import itertools
+import threading
+import time
+
+# Lower numbers are served first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+class RateLimitExceeded(Exception):
+    """Raised instead of waiting when the limiter queue is full or a deadline passes"""
+
+    def __init__(self, message, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def estimate_tokens(input, max_output_tokens: int = 0) -> int:
+    """Rough token count of a prompt (about 4 characters per token) plus its reply budget"""
+    if isinstance(input, str):
+        text = input
+    elif isinstance(input, (list, tuple)):
+        # LangChain messages or (role, content) tuples
+        text = "".join(str(message[1] if isinstance(message, tuple) else getattr(message, 'content', message))
+                       for message in input)
+    else:
+        text = str(input)
+    return len(text) // 4 + 1 + max_output_tokens
+
+class _Bucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount) -> float:
+        """Seconds until the bucket holds amount (amount is capped at capacity)"""
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute, served in priority order.
+
+    Callers block in acquire() until both buckets have room and nobody with a
+    higher priority (or an earlier arrival at the same priority) is waiting.
+    Once max_queue callers are waiting, new ones fail fast with
+    RateLimitExceeded rather than piling up behind them.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, max_queue: int = 64):
+        self.requests = _Bucket(requests_per_minute)
+        self.tokens = _Bucket(tokens_per_minute)
+        self.max_queue = max_queue
+        self._queue = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, tokens: int, priority: int = INTERACTIVE, deadline: float = None):
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                raise RateLimitExceeded("Too many Gemini calls queued", self._retry_after(tokens))
+            entry = (priority, next(self._order))
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    wait = max(self.requests.wait_for(1), self.tokens.wait_for(tokens))
+                    if self._queue[0] == entry and wait == 0:
+                        self.requests.level -= 1
+                        self.tokens.level -= min(tokens, self.tokens.capacity)
+                        return
+                    if deadline is not None and now + wait > deadline:
+                        raise RateLimitExceeded("Gemini rate limit would exceed the call deadline",
+                                                max(wait, self._retry_after(tokens)))
+                    # At the head: sleep until the buckets refill. Otherwise wait to be notified
+                    timeout = wait if self._queue[0] == entry else None
+                    if deadline is not None:
+                        timeout = deadline - now if timeout is None else min(timeout, deadline - now)
+                    self._cond.wait(timeout=timeout)
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+
+    def adjust(self, token_delta: int):
+        """Correct the token bucket once a call reports its real usage"""
+        with self._cond:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level - token_delta)
+            self._cond.notify_all()
+
+    def _retry_after(self, tokens) -> float:
+        return max(1.0, self.requests.wait_for(len(self._queue) + 1), self.tokens.wait_for(tokens))
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": len(self._queue),
+                "request_budget": round(self.requests.level, 2),
+                "token_budget": round(self.tokens.level, 2),
+            }
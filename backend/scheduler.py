@@ -0,0 +1,231 @@
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from gemini_calls import run_prediction, get_model, generate_key_words
+from prediction_cache import normalize_symbol, from_env as prediction_cache_from_env
+from rate_limit import BACKGROUND
+import metrics
+from article_store import from_env as article_store_from_env
+from keyword_cache import from_env as keyword_cache_from_env
+import scrape_articles
+import gemini_calls
+from prediction_memo import PredictionMemo
+import site_adapters
+from db_indexes import ensure_indexes, as_utc
+
+# Must match the frequency options offered by the frontend
+FREQUENCY_SECONDS = {
+    'every_5_minutes': 5 * 60,
+    'every_30_minutes': 30 * 60,
+    'hourly': 60 * 60,
+    'daily': 24 * 60 * 60,
+    'weekly': 7 * 24 * 60 * 60,
+}
+DEFAULT_FREQUENCY = 'every_5_minutes'
+
+def stock_symbol(item):
+    """Portfolio entries are either plain symbols or {'symbol': ...} objects"""
+    symbol = item if isinstance(item, str) else (item or {}).get('symbol')
+    return normalize_symbol(symbol) if symbol else None
+
+def build_analysis_results(symbol, results):
+    """Shape raw pipeline results the way the dashboard saves them to analyses"""
+    predictions = results.get('individual_predictions', {})
+    source_groups = []
+    for source, site in site_adapters.ADAPTERS.items():
+        name = site.display_name
+        articles = results.get(source) or []
+        if not articles:
+            continue
+        summary, sentiment = predictions.get(source) or ('', 'Neutral')
+        source_groups.append({
+            "source": name,
+            "sentiment": sentiment or 'Neutral',
+            "articles": [{"title": a['title'], "summary": a['first_paragraph']} for a in articles],
+            "summary": summary or '',
+        })
+
+    final_summary, final_sentiment = results.get('final_prediction') or (None, None)
+    return {
+        "stock": symbol,
+        "sourceGroups": source_groups or [{
+            "source": 'All news sources',
+            "sentiment": 'Neutral',
+            "articles": [{"title": 'No relevant articles found'}],
+            "summary": "No articles available for analysis",
+        }],
+        "sentiment": final_sentiment or 'Neutral',
+        "summary": final_summary or "No prediction data available",
+        "lastUpdated": datetime.now().isoformat(),
+        "isAnalyzed": True,
+    }
+
+def plan_jobs(users, last_updated, now):
+    """Work out which symbols are due and who is waiting on them.
+
+    users is an iterable of user documents, last_updated maps
+    (username, symbol) to the analysis timestamp. Returns (jobs, next_due):
+    jobs maps each due symbol to the usernames to refresh, next_due is the
+    earliest time anything that is not yet due will become due.
+    """
+    jobs = {}
+    next_due = None
+    for user in users:
+        interval = timedelta(seconds=FREQUENCY_SECONDS.get(user.get('frequency'), FREQUENCY_SECONDS[DEFAULT_FREQUENCY]))
+        for item in user.get('stocks', []):
+            symbol = stock_symbol(item)
+            if not symbol:
+                continue
+            updated = last_updated.get((user['username'], symbol))
+            due = updated + interval if updated else now
+            if due <= now:
+                jobs.setdefault(symbol, []).append(user['username'])
+            elif next_due is None or due < next_due:
+                next_due = due
+    return jobs, next_due
+
+class AnalysisScheduler:
+    """Refreshes every followed symbol once per due window and saves it to analyses"""
+
+    def __init__(self, db, prediction_cache, keyword_cache, model_factory=get_model, workers: int = 2, poll_seconds: int = 60,
+                 on_saved=None):
+        self.db = db
+        self.prediction_cache = prediction_cache
+        self.keyword_cache = keyword_cache
+        self.model_factory = model_factory
+        # Called as on_saved(symbol, usernames, analysis_results, last_updated) after each refresh
+        self.on_saved = on_saved
+        self.poll_seconds = poll_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scheduler')
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self, now=None):
+        """Run every job that is due now. Returns the time the next one is due"""
+        now = now or datetime.now(timezone.utc)
+        users = list(self.db.users.find({}, {"username": 1, "stocks": 1, "frequency": 1}))
+        last_updated = {
+            (doc['username'], doc['symbol']): as_utc(doc['lastUpdated'])
+            for doc in self.db.analyses.find(
+                {"username": {"$in": [user['username'] for user in users]}},
+                {"username": 1, "symbol": 1, "lastUpdated": 1})
+            if isinstance(doc.get('lastUpdated'), datetime)
+        }
+
+        jobs, next_due = plan_jobs(users, last_updated, now)
+        if jobs:
+            print(f"Scheduler refreshing {len(jobs)} symbol(s): {', '.join(jobs)}")
+        futures = [self._executor.submit(self.refresh_symbol, symbol, usernames)
+                   for symbol, usernames in jobs.items()]
+        for future in futures:
+            future.result()
+        return next_due
+
+    def refresh_symbol(self, symbol, usernames):
+        try:
+            results = self.prediction_cache.get_or_compute(
+                symbol, lambda: run_prediction(symbol, self.model_factory(), self.keyword_cache.get))
+        except Exception as e:
+            print(f"Scheduler error analyzing {symbol}: {e}")
+            return
+
+        analysis_results = build_analysis_results(symbol, results)
+        last_updated = datetime.now(timezone.utc)
+        saved = []
+        for username in usernames:
+            try:
+                self.db.analyses.update_one(
+                    {"username": username, "symbol": symbol},
+                    {"$set": {
+                        "username": username,
+                        "symbol": symbol,
+                        "analysisResults": analysis_results,
+                        "lastUpdated": last_updated
+                    }},
+                    upsert=True
+                )
+                saved.append(username)
+            except Exception as e:
+                print(f"Scheduler error saving analysis of {symbol} for {username}: {e}")
+        if saved and self.on_saved is not None:
+            self.on_saved(symbol, saved, analysis_results, last_updated)
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                next_due = self.run_once()
+            except Exception as e:
+                print(f"Scheduler error: {e}")
+                next_due = None
+            # Wake for the next due job, but re-read users regularly to pick up portfolio changes
+            wait = self.poll_seconds
+            if next_due is not None:
+                wait = min(wait, max(1, (next_due - datetime.now(timezone.utc)).total_seconds()))
+            self._stop.wait(wait)
+
+    def start(self):
+        """Run the scheduler on a daemon thread inside the current process"""
+        self._thread = threading.Thread(target=self.run_forever, name='analysis-scheduler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._executor.shutdown(wait=False)
+
+_lock_file = None
+
+def acquire_scheduler_lock(path: str = None) -> bool:
+    """Take an exclusive lock so that one process on this host runs the scheduler.
+
+    The lock is held until the process exits; when that process dies, the
+    server starts a replacement worker, and that worker takes the lock over.
+    """
+    global _lock_file
+    try:
+        import fcntl
+    except ImportError:  # no fcntl (Windows): a single development process
+        return True
+    path = path or os.getenv("SCHEDULER_LOCK_FILE", os.path.join(tempfile.gettempdir(), "stocker-scheduler.lock"))
+    lock_file = open(path, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _lock_file = lock_file
+    return True
+
+def scheduler_from_env(db, prediction_cache, keyword_cache, on_saved=None):
+    return AnalysisScheduler(
+        db,
+        prediction_cache,
+        keyword_cache,
+        # Refreshes yield Gemini quota to interactive requests
+        model_factory=lambda: get_model().with_priority(BACKGROUND),
+        workers=int(os.getenv("SCHEDULER_WORKERS", "2")),
+        poll_seconds=int(os.getenv("SCHEDULER_POLL_SECONDS", "60")),
+        on_saved=on_saved,
+    )
+
+if __name__ == '__main__':
+    # Standalone worker: python scheduler.py
+    load_dotenv()
+    client = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017/"), event_listeners=[metrics.MongoListener()])
+    db = client.stockerdb
+    ensure_indexes(db)
+    scrape_articles.set_article_store(article_store_from_env(db.articles))
+    gemini_calls.set_prediction_memo(PredictionMemo(db.predictions))
+    scheduler = scheduler_from_env(db, prediction_cache_from_env(db.predictions),
+                                   keyword_cache_from_env(generate_key_words, db.keywords))
+    print("Analysis scheduler started")
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        scheduler.stop()
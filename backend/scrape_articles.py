@@ -1,128 +1,337 @@
+import dataclasses
+import threading
+import time
+from collections import deque
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from extractors import get_extractor, decode_chunks
+import site_adapters
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from typing import List
 from urllib.parse import urlparse
+import metrics
 
-def get_site_type(base_url: str) -> str:
-    domain = urlparse(base_url).netloc
-    if 'fox' in domain:
-        return 'fox'
-    elif 'guardian' in domain:
-        return 'guardian'
-    elif 'cnn' in domain:
-        return 'cnn'
-    else:
-        return 'unknown'
-
-def scrape_site(base_url: str, keywords: List[str]):
-    """Scrape individual site with error handling"""
-    site_type = get_site_type(base_url)
-    
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# Overall wall-clock budget for one scrape_news call
+SCRAPE_DEADLINE = 15
+# Seconds the front-page headlines are shared before they are fetched again
+HEADLINE_SNAPSHOT_TTL = 120
+
+_site_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='scrape-site')
+_article_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='scrape-article')
+
+# HTML parsing backend (lxml when installed, see SCRAPE_PARSER)
+extractor = get_extractor()
+
+# Optional ArticleStore so each article is downloaded and parsed only once
+article_store = None
+
+_snapshot_lock = threading.Lock()
+_snapshot = {}  # site name -> (headlines, monotonic time they were fetched)
+
+_host_lock = threading.Lock()
+_hosts = {}
+
+class _Host:
+    """Keep-alive session and fetch policy shared by all requests to one host"""
+
+    def __init__(self, site):
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        http_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=site.max_connections)
+        self.session.mount('http://', http_adapter)
+        self.session.mount('https://', http_adapter)
+        self.connections = threading.BoundedSemaphore(site.max_connections)
+        self.interval = 1.0 / site.requests_per_second if site.requests_per_second else 0.0
+        self._pace_lock = threading.Lock()
+        self._next_start = 0.0
+
+    def reserve_start(self) -> float:
+        """Monotonic time at which the next request may start under the host's rate limit"""
+        with self._pace_lock:
+            start = max(time.monotonic(), self._next_start)
+            self._next_start = start + self.interval
+            return start
+
+def _host_state(url: str, site) -> _Host:
+    """The _Host for url's host, created with the policy of the site that first fetched it"""
+    host = urlparse(url).netloc
+    with _host_lock:
+        if host not in _hosts:
+            _hosts[host] = _Host(site_adapters.for_url(url) or site)
+        return _hosts[host]
+
+def shutdown():
+    """Stop the scraper's thread pools and close its host sessions"""
+    _site_executor.shutdown(wait=False, cancel_futures=True)
+    _article_executor.shutdown(wait=False, cancel_futures=True)
+    with _host_lock:
+        for host in _hosts.values():
+            host.session.close()
+        _hosts.clear()
+
+def set_article_store(store):
+    global article_store
+    article_store = store
+
+def fetch(site, url: str, timeout: float, deadline: float = None, headers: dict = None, stream: bool = False):
+    """GET a url through its host's session and policy, never running past the deadline"""
+    host = _host_state(url, site)
+    end = time.monotonic() + timeout
+    if deadline is not None:
+        end = min(end, deadline)
+    if end <= time.monotonic():
+        raise TimeoutError(f"Scrape deadline passed before fetching {url}")
+    if not host.connections.acquire(timeout=end - time.monotonic()):
+        raise TimeoutError(f"Timed out waiting for a connection to {urlparse(url).netloc}")
+    release = True
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(base_url, headers=headers, timeout=10)
-        response.raise_for_status()        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        headline_elements = []
-        
-        if site_type == 'fox':
-            all_headers = soup.find_all('header', class_='info-header')
-            valid_headers = []
-            for header in all_headers:
-                title_tag = header.find(['h2', 'h3'], class_='title')
-                if title_tag and title_tag.find('a'):
-                    valid_headers.append(header)
-            headline_elements = valid_headers[:5]
-        elif site_type == 'guardian':
-            headline_elements = soup.find_all('a', class_='dcr-2yd10d')[:5]
-        elif site_type == 'cnn':
-            headline_elements = soup.find_all(['span'], 
-                class_=lambda x: x and 'headline' in x.lower())[:5]
-        else:
-            return {base_url: []}
-
-        matching_headlines = []
-
-        for element in headline_elements:
+        start = host.reserve_start()
+        if start >= end:
+            raise TimeoutError(f"Rate limit for {urlparse(url).netloc} would delay {url} past its deadline")
+        time.sleep(max(0.0, start - time.monotonic()))
+        with metrics.span('fetch', host=urlparse(url).netloc):
+            response = host.session.get(url, timeout=end - time.monotonic(), headers=headers, stream=stream)
             try:
-                title, url = '', ''
-                
-                if site_type == 'fox':
-                    title_tag = element.find(['h2', 'h3'], class_='title')
-                    if title_tag:
-                        a_tag = title_tag.find('a')
-                        if a_tag:
-                            url = a_tag.get('href', '')
-                            title = a_tag.get_text(strip=True)
-                elif site_type == 'guardian':
-                    url = element.get('href', '')
-                    title = element.get('aria-label', '')  
-                elif site_type == 'cnn':
-                    title = element.get_text(strip=True)
-                    parent_a = element.find_parent('a')
-                    url = element.get('href', '') if element.name == 'a' else (parent_a.get('href', '') if parent_a else '')
-
-                # Validate and normalize URL
-                if url and not url.startswith('http'):
-                    url = requests.compat.urljoin(base_url, url)
-                
-                if title and url and any(kw.lower() in title.lower() for kw in keywords):
-                    first_paragraph = ""                    
-                    try:
-                        article_response = requests.get(url, headers=headers, timeout=5)
-                        article_response.raise_for_status()
-                        article_soup = BeautifulSoup(article_response.text, 'html.parser')
-                        
-                        # Extract first paragraph based on site type
-                        if site_type == 'cnn':
-                            content_div = article_soup.find('div', class_='article__content')
-                            if content_div:
-                                first_p = content_div.find('p')
-                                first_paragraph = first_p.get_text(strip=True) if first_p else ""
-                        elif site_type == 'guardian':
-                            content_div = article_soup.find('div', class_='article-body-commercial-selector article-body-viewer-selector dcr-11jq3zt')
-                            if content_div:
-                                first_p = content_div.find('p')
-                                first_paragraph = first_p.get_text(strip=True) if first_p else ""
-                        elif site_type == 'fox':
-                            content_div = article_soup.find('div', class_='article-body')
-                            if content_div:
-                                first_p = content_div.find('p')
-                                first_paragraph = first_p.get_text(strip=True) if first_p else ""
-                    except Exception as e:
-                        print(f"Error fetching {site_type} article content: {str(e)}")
-                        first_paragraph = "[Content unavailable]"
-                    
-                    matching_headlines.append({
-                        'title': title,
-                        'url': url,
-                        'first_paragraph': first_paragraph
-                    })
-                             
-            except Exception as e:
-                print(f"Error processing headline element: {str(e)}")
-                continue
+                response.raise_for_status()
+            except Exception:
+                response.close()
+                raise
+        if stream:
+            # The body is read after we return: the host slot is held until the response is closed
+            _release_on_close(response, host.connections)
+            release = False
+        return response
+    finally:
+        if release:
+            host.connections.release()
+
+def _release_on_close(response, connections):
+    close = response.close
+    released = []
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if not released:
+                released.append(True)
+                connections.release()
+
+    response.close = close_and_release
+
+def fetch_first_paragraph(site, url: str, deadline: float = None) -> str:
+    """Fetch an article and return its first paragraph, or a placeholder on failure"""
+    stored = article_store.get(url) if article_store else None
+    if stored and article_store.is_fresh(stored):
+        metrics.cache_result('article', 'hit')
+        return stored["first_paragraph"]
+
+    try:
+        conditional = article_store.conditional_headers(stored) if stored else None
+        read_deadline = time.monotonic() + site.article_timeout
+        if deadline is not None:
+            read_deadline = min(read_deadline, deadline)
+        # Streamed so the extractor can stop reading once it has the first paragraph
+        article_response = fetch(site, url, site.article_timeout, deadline, headers=conditional, stream=True)
+        with article_response:
+            if stored and article_response.status_code == 304:
+                metrics.cache_result('article', 'revalidated')
+                article_store.touch(url)
+                return stored["first_paragraph"]
+
+            with metrics.span('parse'):
+                first_paragraph = extractor.first_paragraph(site, decode_chunks(article_response, deadline=read_deadline))
+        if article_store:
+            metrics.cache_result('article', 'miss')
+            article_store.put(url, first_paragraph,
+                              etag=article_response.headers.get('ETag'),
+                              last_modified=article_response.headers.get('Last-Modified'))
+        return first_paragraph
+    except Exception as e:
+        print(f"Error fetching {site.name} article content: {str(e)}")
+        return "[Content unavailable]"
+
+class KeywordMatcher:
+    """Aho-Corasick automaton matching many keywords against a title in one pass.
+
+    Matching is case-insensitive substring matching, the same as
+    `kw.lower() in title.lower()` for every keyword, but each title is
+    scanned once no matter how many keywords or symbols are registered.
+    """
 
-        return {site_type: matching_headlines}
-    
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [set()]
+        self._always = set()
+        self._built = False
+
+    def add(self, keyword: str, tag):
+        keyword = keyword.lower()
+        if not keyword:
+            # An empty keyword is a substring of every title
+            self._always.add(tag)
+            return
+        state = 0
+        for char in keyword:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(set())
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._out[state].add(tag)
+        self._built = False
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._out[child] |= self._out[self._fail[child]]
+        self._built = True
+
+    def match(self, text: str) -> set:
+        """Return the tags of every keyword that occurs in text"""
+        if not self._built:
+            self._build()
+        found = set(self._always)
+        state = 0
+        for char in text.lower():
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            found |= self._out[state]
+        return found
+
+def fetch_headlines(site, deadline: float = None):
+    """Fetch a site's front page and return [{'title', 'url'}] for its top headlines; raises on failure"""
+    response = fetch(site, site.url, site.front_page_timeout, deadline)
+    headlines = []
+    with metrics.span('parse'):
+        extracted = extractor.headlines(site, response.text)
+    for title, url in extracted:
+        # Validate and normalize URL
+        if url and not url.startswith('http'):
+            url = requests.compat.urljoin(site.url, url)
+
+        if title and url:
+            headlines.append({'title': title, 'url': url})
+
+    return headlines
+
+def scrape_headlines(site, deadline: float = None):
+    """fetch_headlines(), with errors logged and returned as no headlines"""
+    try:
+        return fetch_headlines(site, deadline)
     except Exception as e:
-        print(f"Error scraping {site_type}: {str(e)}")
-        return {site_type: []}
-
-def scrape_news(keywords):
-    """Scrape all specified sites simultaneously"""
-    cnn_scrape_res = scrape_site("https://www.cnn.com/business/investing", keywords)
-    guardian_scrape_res = scrape_site("https://www.theguardian.com/us/business", keywords)
-    fox_scrape_res = scrape_site("https://www.foxbusiness.com/", keywords)
-    
-    aggregated = {}
-    for result in [cnn_scrape_res, guardian_scrape_res, fox_scrape_res]:
-        aggregated.update(result)
-    
-    return aggregated
+        print(f"Error scraping {site.name}: {str(e)}")
+        return []
+
+def headline_snapshot(deadline: float = None):
+    """Headlines of every enabled site, each fetched at most once per HEADLINE_SNAPSHOT_TTL.
+
+    Callers arriving while a refresh is running wait for it instead of
+    downloading the front pages again. A site whose refresh fails keeps its
+    last good headlines, and is not marked fresh, so the next caller tries
+    it again; with nothing stored it gives no headlines for this call only.
+    """
+    with _snapshot_lock:
+        now = time.monotonic()
+        sites = site_adapters.enabled()
+        stale = [site for site in sites
+                 if site.name not in _snapshot or now - _snapshot[site.name][1] >= HEADLINE_SNAPSHOT_TTL]
+        if not stale:
+            metrics.cache_result('headlines', 'hit')
+            return {site.name: _snapshot[site.name][0] for site in sites}
+        metrics.cache_result('headlines', 'miss')
+
+        deadline = deadline or now + SCRAPE_DEADLINE
+        futures = {site.name: metrics.submit(_site_executor, fetch_headlines, site, deadline) for site in stale}
+        for name, future in futures.items():
+            try:
+                _snapshot[name] = (future.result(timeout=max(0, deadline - time.monotonic())), time.monotonic())
+            except FutureTimeoutError:
+                print(f"Error scraping {name}: scrape deadline exceeded")
+            except Exception as e:
+                print(f"Error scraping {name}: {str(e)}")
+
+        return {site.name: _snapshot[site.name][0] if site.name in _snapshot else [] for site in sites}
+
+def match_headlines(snapshot, keywords_by_symbol):
+    """Match every symbol's keywords against the snapshot in a single pass.
+
+    Returns {symbol: {site: [{'title', 'url'}]}}, keeping headline order.
+    """
+    matcher = KeywordMatcher()
+    for symbol, keywords in keywords_by_symbol.items():
+        for kw in keywords:
+            matcher.add(kw, symbol)
+
+    matched = {symbol: {site: [] for site in snapshot} for symbol in keywords_by_symbol}
+    for site, headlines in snapshot.items():
+        for headline in headlines:
+            for symbol in matcher.match(headline['title']):
+                matched[symbol][site].append(dict(headline))
+    return matched
+
+def fetch_articles(matched, deadline: float = None):
+    """Fill in first_paragraph for every matched headline, fetching each URL once.
+
+    Headlines whose article is not fetched by the deadline are dropped.
+    """
+    futures = {}
+    for sites in matched.values():
+        for name, headlines in sites.items():
+            for headline in headlines:
+                if headline['url'] not in futures:
+                    futures[headline['url']] = metrics.submit(_article_executor,
+                        fetch_first_paragraph, site_adapters.ADAPTERS[name], headline['url'], deadline)
+    paragraphs = {}
+    for url, future in futures.items():
+        try:
+            paragraphs[url] = future.result(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            future.cancel()
+            print(f"Dropping article {url}: scrape deadline exceeded")
+    for sites in matched.values():
+        for name, headlines in sites.items():
+            sites[name] = [headline for headline in headlines if headline['url'] in paragraphs]
+            for headline in sites[name]:
+                headline['first_paragraph'] = paragraphs[headline['url']]
+    return matched
+
+def scrape_news_batch(keywords_by_symbol, deadline: float = SCRAPE_DEADLINE):
+    """Scrape once for many symbols: {symbol: keywords} -> {symbol: {site: articles}}"""
+    deadline_at = time.monotonic() + deadline
+    snapshot = headline_snapshot(deadline_at)
+    return fetch_articles(match_headlines(snapshot, keywords_by_symbol), deadline_at)
+
+def scrape_site(base_url: str, keywords: List[str], deadline: float = None):
+    """Scrape individual site with error handling"""
+    site = site_adapters.for_url(base_url)
+    if site is None:
+        print(f"No site adapter registered for {base_url}")
+        return {}
+    if site.url != base_url:
+        site = dataclasses.replace(site, url=base_url)
+    matched = match_headlines({site.name: scrape_headlines(site, deadline)}, {None: keywords})
+    return fetch_articles(matched, deadline)[None]
+
+def scrape_news(keywords, deadline: float = SCRAPE_DEADLINE):
+    """Scrape all enabled sites simultaneously"""
+    return scrape_news_batch({None: keywords}, deadline)[None]
 
 def format_results(aggregated):
     """Format the aggregated results into a readable string"""
@@ -134,10 +343,10 @@ def format_results(aggregated):
                 result += f"Article {i} title: {article['title']}\n"
                 result += f"Article {i} URL: {article['url']}\n"
                 result += f"Article {i} summary: {article['first_paragraph']}\n\n"
-    
+
     return result or "No matching articles found."
-    
+
 if __name__=="__main__":
     keywords = ["tariff"]
     results = scrape_news(keywords)
-    print(format_results(results))
\ No newline at end of file
+    print(format_results(results))
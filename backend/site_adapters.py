@@ -0,0 +1,97 @@
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from urllib.parse import urlparse
+
+@dataclass(frozen=True)
+class SiteAdapter:
+    """Everything the scraper needs to know about one news source.
+
+    Selectors are CSS, understood by both the BeautifulSoup and lxml
+    extractors. For each element matching headline_selector (in document
+    order, up to max_headlines that have a link):
+
+    - link_selector picks the <a> inside it; without one the headline
+      itself or its nearest enclosing <a> is the link
+    - the title is title_attribute of the link element when set (the
+      headline element when there is no link_selector), else its text
+
+    The article summary is the first <p> inside the first element matching
+    body_selector, which must be a simple selector (tag, classes,
+    attributes) so it can be checked while the page is still streaming in.
+
+    Fetch policy applies to every host in domains: at most max_connections
+    requests at once, at most requests_per_second started per second (None
+    for no limit), and the given timeouts in seconds.
+    """
+
+    name: str
+    display_name: str
+    url: str
+    domains: Tuple[str, ...]
+    headline_selector: str
+    body_selector: str
+    link_selector: Optional[str] = None
+    title_attribute: Optional[str] = None
+    max_headlines: int = 5
+    max_connections: int = 4
+    requests_per_second: Optional[float] = None
+    front_page_timeout: float = 10
+    article_timeout: float = 5
+
+    def handles(self, url: str) -> bool:
+        host = urlparse(url).netloc.lower()
+        return any(host == domain or host.endswith('.' + domain) for domain in self.domains)
+
+# Registered adapters by name, in the order results are returned
+ADAPTERS = {}
+
+def register(adapter: SiteAdapter):
+    ADAPTERS[adapter.name] = adapter
+    return adapter
+
+def enabled():
+    """Adapters to scrape: those named in SCRAPE_SITES (comma separated), or all of them"""
+    names = [name.strip() for name in os.getenv("SCRAPE_SITES", "").split(",") if name.strip()]
+    if not names:
+        return list(ADAPTERS.values())
+    unknown = [name for name in names if name not in ADAPTERS]
+    if unknown:
+        print(f"Ignoring unknown SCRAPE_SITES: {', '.join(unknown)}")
+    return [ADAPTERS[name] for name in names if name in ADAPTERS]
+
+def for_url(url: str) -> Optional[SiteAdapter]:
+    """The adapter whose domains cover url, if any"""
+    for adapter in ADAPTERS.values():
+        if adapter.handles(url):
+            return adapter
+    return None
+
+register(SiteAdapter(
+    name='cnn',
+    display_name='CNN',
+    url="https://www.cnn.com/business/investing",
+    domains=('cnn.com',),
+    headline_selector='span[class*="headline"]',
+    body_selector='div.article__content',
+))
+
+register(SiteAdapter(
+    name='guardian',
+    display_name='The Guardian',
+    url="https://www.theguardian.com/us/business",
+    domains=('theguardian.com',),
+    headline_selector='a.dcr-2yd10d',
+    title_attribute='aria-label',
+    body_selector='div.article-body-commercial-selector.article-body-viewer-selector.dcr-11jq3zt',
+))
+
+register(SiteAdapter(
+    name='fox',
+    display_name='Fox News',
+    url="https://www.foxbusiness.com/",
+    domains=('foxbusiness.com', 'foxnews.com'),
+    headline_selector='header.info-header',
+    link_selector='h2.title a, h3.title a',
+    body_selector='div.article-body',
+))
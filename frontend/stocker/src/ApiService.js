@@ -1,6 +1,4 @@
 const API_BASE_URL = 'http://localhost:8000/api';
-const POLYGON_API_BASE_URL = 'https://api.polygon.io';
-const POLYGON_API_KEY = 'Ipp3SKTtHg0TIEIRDUShlcm5tUNnyQKL';
 
 const ApiService = {
   testConnection: async () => {
@@ -89,7 +87,7 @@ const ApiService = {
 
   verifyStockSymbol: async (symbol) => {
     try {
-      const response = await fetch(`${POLYGON_API_BASE_URL}/v3/reference/tickers/${symbol}?apiKey=${POLYGON_API_KEY}`);
+      const response = await fetch(`${API_BASE_URL}/market/ticker/${symbol}`);
       
       if (!response.ok) {
         return { valid: false };
@@ -97,9 +95,9 @@ const ApiService = {
       
       const data = await response.json();
       return { 
-        valid: true, 
-        name: data.results?.name || symbol,
-        market: data.results?.market || 'Unknown'
+        valid: data.ticker.valid, 
+        name: data.ticker.name || symbol,
+        market: data.ticker.market || 'Unknown'
       };
     } catch (error) {
       console.error('Stock verification error:', error);
@@ -110,7 +108,7 @@ const ApiService = {
   getHistoricalData: async (symbol, from, to, timespan = 'day') => {
     try {
       const response = await fetch(
-        `${POLYGON_API_BASE_URL}/v2/aggs/ticker/${symbol}/range/1/${timespan}/${from}/${to}?apiKey=${POLYGON_API_KEY}`
+        `${API_BASE_URL}/market/bars/${symbol}?from=${from}&to=${to}&timespan=${timespan}`
       );
       
       if (!response.ok) {
@@ -128,7 +126,7 @@ const ApiService = {
   getStockDetails: async (symbol) => {
     try {
       const response = await fetch(
-        `${POLYGON_API_BASE_URL}/v2/aggs/ticker/${symbol}/prev?apiKey=${POLYGON_API_KEY}`
+        `${API_BASE_URL}/market/prev/${symbol}`
       );
       
       if (!response.ok) {
@@ -136,13 +134,175 @@ const ApiService = {
       }
       
       const data = await response.json();
-      return data.results?.[0] || null;
+      return data.results || null;
     } catch (error) {
       console.error('Stock details error:', error);
       throw error;
     }
   },
 
+  // Name and market for many symbols in one request: { results: { SYMBOL: { valid, name, market } }, errors }
+  getPortfolioDetails: async (symbols) => {
+    try {
+      const response = await fetch(`${API_BASE_URL}/market/batch`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ symbols })
+      });
+      return await response.json();
+    } catch (error) {
+      console.error('Portfolio details error:', error);
+      throw error;
+    }
+  },
+
+  // One request for many symbols: { results: { SYMBOL: results }, errors: { SYMBOL: message } }
+  predictBatch: async (symbols) => {
+    try {
+      const response = await fetch(`${API_BASE_URL}/predict/batch`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ stocks: symbols })
+      });
+      return await response.json();
+    } catch (error) {
+      console.error('Batch prediction error:', error);
+      throw error;
+    }
+  },
+
+  // Opens /analyses/subscribe and calls onAnalysis({ symbol, analysis, lastUpdated }) with the current
+  // analysis of each symbol, then again whenever one is saved. When the server turns the stream away
+  // (it caps open subscriptions) the analyses are polled each minute instead, trying the stream again
+  // every ten minutes. Returns a function that stops the updates.
+  subscribeAnalyses: (username, symbols, onAnalysis) => {
+    let source = null;
+    let pollTimer = null;
+    let stopped = false;
+    const seen = {};
+
+    const deliver = (update) => {
+      if (seen[update.symbol] === update.lastUpdated) return;
+      seen[update.symbol] = update.lastUpdated;
+      onAnalysis(update);
+    };
+
+    const poll = async () => {
+      for (const symbol of symbols) {
+        const saved = await ApiService.getAnalysisResults(username, symbol);
+        if (saved.success && saved.analysis && saved.lastUpdated) {
+          deliver({ symbol: symbol.toUpperCase(), analysis: saved.analysis, lastUpdated: saved.lastUpdated });
+        }
+      }
+    };
+
+    const startPolling = () => {
+      if (pollTimer || stopped) return;
+      console.warn('Analysis updates unavailable, polling instead');
+      let ticks = 0;
+      poll();
+      pollTimer = setInterval(() => {
+        ticks += 1;
+        if (ticks % 10 === 0) {
+          clearInterval(pollTimer);
+          pollTimer = null;
+          connect();
+        } else {
+          poll();
+        }
+      }, 60000);
+    };
+
+    const connect = () => {
+      if (stopped) return;
+      source = new EventSource(
+        `${API_BASE_URL}/analyses/subscribe?username=${encodeURIComponent(username)}&symbols=${symbols.map(encodeURIComponent).join(',')}`
+      );
+      source.addEventListener('analysis', (event) => {
+        try {
+          deliver(JSON.parse(event.data));
+        } catch (error) {
+          console.error('Analysis update error:', error);
+        }
+      });
+      source.onerror = () => {
+        // a refused stream (e.g. 503 when the server is full) is closed for good; dropped ones reconnect
+        // by themselves and the server resends current analyses on reconnect
+        if (source.readyState === EventSource.CLOSED) {
+          startPolling();
+        } else {
+          console.warn('Analysis updates disconnected, reconnecting...');
+        }
+      };
+    };
+
+    connect();
+    return () => {
+      stopped = true;
+      if (source) source.close();
+      if (pollTimer) clearInterval(pollTimer);
+    };
+  },
+
+  // Streams /predict/stream, calling onEvent(event, data) for keywords, articles,
+  // prediction and final events as the backend produces them. Resolves with the final results.
+  streamPrediction: async (symbol, onEvent) => {
+    const response = await fetch(`${API_BASE_URL}/predict/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ stock: symbol })
+    });
+
+    if (!response.ok || !response.body) {
+      throw new Error('Failed to start prediction stream');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let finalResults = null;
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const chunk = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        let event = 'message';
+        let data = '';
+        chunk.split('\n').forEach(line => {
+          if (line.startsWith('event: ')) event = line.slice(7);
+          else if (line.startsWith('data: ')) data += line.slice(6);
+        });
+        // comments and retry hints carry no data
+        if (!data) continue;
+        const parsed = JSON.parse(data);
+
+        if (event === 'error') {
+          throw new Error(parsed?.message || 'Prediction stream failed');
+        }
+        if (onEvent) onEvent(event, parsed);
+        if (event === 'final') {
+          // nothing follows the final results
+          reader.cancel();
+          return parsed;
+        }
+      }
+    }
+
+    return finalResults;
+  },
+
   saveAnalysisResults: async (username, symbol, analysisResults) => {
     try {
       const response = await fetch(`${API_BASE_URL}/saveAnalysis`, {
@@ -168,9 +328,11 @@ const ApiService = {
     }
   },
   
-  getAnalysisResults: async (username, symbol) => {
+  // fields: optional list of analysis fields to return (e.g. ['lastUpdated']) instead of the whole analysis
+  getAnalysisResults: async (username, symbol, fields = null) => {
     try {
-      const response = await fetch(`${API_BASE_URL}/getAnalysis?username=${username}&symbol=${symbol}`);
+      const fieldsParam = fields ? `&fields=${fields.join(',')}` : '';
+      const response = await fetch(`${API_BASE_URL}/getAnalysis?username=${username}&symbol=${symbol}${fieldsParam}`);
       const data = await response.json();
       return data;
     } catch (error) {
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { AlertCircle, CheckCircle, Eye, EyeOff, TrendingUp, FileText, Search, Briefcase } from 'lucide-react';
 import './stocker.css';
 import ApiService from './ApiService';
@@ -47,8 +47,12 @@ const EnhancedStockApp = () => {
   const [showPortfolioForm, setShowPortfolioForm] = useState(false);
   const [analysisResults, setAnalysisResults] = useState({});
   const [isAnalyzing, setIsAnalyzing] = useState(false);
+  const [analysisProgress, setAnalysisProgress] = useState(null); // latest stage streamed while analyzing
   const [selectedStock, setSelectedStock] = useState(null);
   const [portfolioDetails, setPortfolioDetails] = useState({}); 
+  // last saved time of each symbol's analysis, kept current by the analysis update stream
+  const lastUpdatedRef = useRef({});
+  const selectedStockRef = useRef(null);
   
   // Stock verification and historical data states
   const [isVerifyingStock, setIsVerifyingStock] = useState(false);
@@ -85,6 +89,33 @@ const EnhancedStockApp = () => {
     }
   }, [isAuthenticated]); 
 
+  useEffect(() => {
+    selectedStockRef.current = selectedStock;
+  }, [selectedStock]);
+
+  // the server pushes each saved analysis of the portfolio's stocks, so nothing polls for changes
+  useEffect(() => {
+    if (!isAuthenticated || !currentUser || !currentUser.username || portfolio.length === 0) return;
+    
+    const userStocks = portfolio.map(item => 
+      typeof item === 'string' ? item : item.symbol
+    );
+    
+    return ApiService.subscribeAnalyses(currentUser.username, userStocks, (update) => {
+      lastUpdatedRef.current[update.symbol] = new Date(update.lastUpdated);
+      
+      const selected = selectedStockRef.current;
+      if (selected && selected.toUpperCase() === update.symbol && update.analysis) {
+        setAnalysisResults({
+          ...update.analysis,
+          stock: selected,
+          isAnalyzed: true,
+          isSavedResult: true
+        });
+      }
+    });
+  }, [isAuthenticated, currentUser, portfolio]);
+
   useEffect(() => {
     if (!isAuthenticated || !currentUser || !currentUser.frequency) return;
     
@@ -100,7 +131,7 @@ const EnhancedStockApp = () => {
     
     console.log(`Setting up auto-update interval: ${interval}ms (${currentUser.frequency})`);
     
-    // check for updates every minute
+    // check every minute for due stocks (no requests unless one is due)
     const checkInterval = setInterval(async () => {
       if (!currentUser || !currentUser.username) return;
       
@@ -110,42 +141,47 @@ const EnhancedStockApp = () => {
         typeof item === 'string' ? item : item.symbol
       );
       
-      // for each stock, check if analysis exists and needs update
+      // find the stocks whose analysis is older than the frequency, from the timestamps the server pushed
+      // (when the backend scheduler keeps them fresh, nothing is ever due here)
+      const dueStocks = [];
       for (const stockSymbol of userStocks) {
+        const lastUpdated = lastUpdatedRef.current[stockSymbol.toUpperCase()];
+        if (!lastUpdated) continue;
+        
+        const timeDiff = new Date().getTime() - lastUpdated.getTime();
+        
+        // if time since last update exceeds the frequency
+        if (timeDiff >= interval) {
+          console.log(`Updating analysis for ${stockSymbol} (last updated: ${lastUpdated.toISOString()})`);
+          dueStocks.push(stockSymbol);
+        }
+      }
+      if (dueStocks.length === 0) return;
+      
+      // predict every due stock with one batch request
+      let batch = null;
+      try {
+        batch = await ApiService.predictBatch(dueStocks);
+      } catch (error) {
+        console.error("Batch prediction failed, updating stocks one by one:", error);
+      }
+      
+      for (const stockSymbol of dueStocks) {
         try {
-          const savedResults = await ApiService.getAnalysisResults(currentUser.username, stockSymbol);
+          if (selectedStock === stockSymbol) {
+            setIsAnalyzing(true);
+          }
           
-          if (savedResults.success && savedResults.analysis && savedResults.lastUpdated) {
-            const lastUpdated = new Date(savedResults.lastUpdated);
-            const now = new Date();
-            const timeDiff = now.getTime() - lastUpdated.getTime();
-            
-            // if time since last update exceeds the frequency
-            if (timeDiff >= interval) {
-              console.log(`Updating analysis for ${stockSymbol} (last updated: ${savedResults.lastUpdated})`);
-              
-              if (selectedStock === stockSymbol) {
-                setIsAnalyzing(true);
-              }
-              
-              await performAnalysis(stockSymbol, true);
-              
-              if (selectedStock === stockSymbol) {
-                const updatedResults = await ApiService.getAnalysisResults(currentUser.username, stockSymbol);
-                if (updatedResults.success && updatedResults.analysis) {
-                  setAnalysisResults({
-                    ...updatedResults.analysis,
-                    stock: stockSymbol,
-                    isAnalyzed: true,
-                    isSavedResult: true
-                  });
-                }
-                setIsAnalyzing(false);
-              }
-            }
+          // symbols the batch could not predict fall back to their own request
+          const batchResults = batch && batch.success && batch.results ? batch.results[stockSymbol.toUpperCase()] : null;
+          // saving it pushes the new analysis back through the update stream
+          await performAnalysis(stockSymbol, true, batchResults ? { success: true, results: batchResults } : null);
+          
+          if (selectedStock === stockSymbol) {
+            setIsAnalyzing(false);
           }
         } catch (error) {
-          console.error(`Error checking/updating analysis for ${stockSymbol}:`, error);
+          console.error(`Error updating analysis for ${stockSymbol}:`, error);
         }
       }
     }, 60000); // check every minute
@@ -153,18 +189,43 @@ const EnhancedStockApp = () => {
     return () => clearInterval(checkInterval);
   }, [isAuthenticated, currentUser, portfolio, selectedStock]);
   
-  const performAnalysis = async (stockSymbol, isBackground = false) => {
+  // prefetched: a response already obtained for this stock (e.g. from a batch prediction)
+  const performAnalysis = async (stockSymbol, isBackground = false, prefetched = null) => {
     if (!currentUser || !currentUser.username) return null;
     
     try {
-      const response = await fetch('http://localhost:8000/api/predict', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ stock: stockSymbol })
-      });
-      const data = await response.json();
+      let data = prefetched;
+      if (!data && !isBackground) {
+        // stream the prediction so the loading screen shows each stage as it finishes
+        try {
+          const finalResults = await ApiService.streamPrediction(stockSymbol, (event, payload) => {
+            if (event === 'keywords') {
+              setAnalysisProgress(`Searching the news for ${payload.join(', ')}...`);
+            } else if (event === 'articles') {
+              setAnalysisProgress(`Found ${payload.articles.length} article(s) from ${payload.source}...`);
+            } else if (event === 'prediction') {
+              setAnalysisProgress(`${payload.source} prediction ready...`);
+            }
+          });
+          if (finalResults) {
+            data = { success: true, results: finalResults };
+          }
+        } catch (streamError) {
+          console.error("Prediction stream failed, requesting it directly:", streamError);
+        } finally {
+          setAnalysisProgress(null);
+        }
+      }
+      if (!data) {
+        const response = await fetch('http://localhost:8000/api/predict', {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify({ stock: stockSymbol })
+        });
+        data = await response.json();
+      }
       console.log(data);
       
       if (data.success && data.results) {
@@ -845,7 +906,7 @@ const EnhancedStockApp = () => {
       const from = formatDate(startDate);
       const to = formatDate(endDate);
       
-      // Fetch data from Polygon API via your service
+      // Fetch bars through the backend's shared market data store
       const data = await ApiService.getHistoricalData(symbol, from, to);
       
       // Only update if we got data back
@@ -1535,7 +1596,7 @@ const EnhancedStockApp = () => {
           <div className="analysis-loading">
             <div className="loading-spinner"></div>
             <p>Analyzing {selectedStock}...</p>
-            <p className="loading-detail">Gathering news and market data...</p>
+            <p className="loading-detail">{analysisProgress || 'Gathering news and market data...'}</p>
           </div>
         ) : (
           <div className="analysis-results">
@@ -1728,23 +1789,30 @@ const EnhancedStockApp = () => {
       setIsLoading(true);
     }
     
-    for (const stock of newStocks) {
+    if (newStocks.length > 0) {
       try {
-        const stockInfo = await ApiService.verifyStockSymbol(stock);
-        if (stockInfo.valid) {
-          details[stock] = {
-            symbol: stock,
-            name: stockInfo.name || stock,
-            market: stockInfo.market
-          };
-        } else {
-          // Add placeholder if verification fails
-          details[stock] = { symbol: stock, name: stock };
+        // One request for the whole portfolio
+        const response = await ApiService.getPortfolioDetails(newStocks);
+        const results = (response && response.results) || {};
+        for (const stock of newStocks) {
+          const stockInfo = results[stock.toUpperCase()];
+          if (stockInfo && stockInfo.valid) {
+            details[stock] = {
+              symbol: stock,
+              name: stockInfo.name || stock,
+              market: stockInfo.market
+            };
+          } else {
+            // Add placeholder if verification fails
+            details[stock] = { symbol: stock, name: stock };
+          }
         }
       } catch (error) {
-        console.error(`Error fetching details for ${stock}:`, error);
-        // Add a fallback entry with just the symbol
-        details[stock] = { symbol: stock, name: stock };
+        console.error('Error fetching portfolio details:', error);
+        // Add fallback entries with just the symbol
+        for (const stock of newStocks) {
+          details[stock] = { symbol: stock, name: stock };
+        }
       }
     }
     